@@ -0,0 +1,193 @@
+"""Command line batch mode of Outlook - Cleaning.py: searches duplicates without user interface, e.g. in a scheduled task.
+Qt is never imported, and win32com only to read an Outlook mailbox. Results are streamed to a CSV or JSON Lines report.
+Examples:
+    python "Outlook - Cleaning.py" --mailbox john.doe@company.com --output duplicates.jsonl
+    python "Outlook - Cleaning.py" --archive D:\\Export\\Inbox.mbox --output duplicates.csv --workers 8
+    python "Outlook - Cleaning.py" --mailbox john.doe@company.com --session duplicates.parquet, then later:
+    python "Outlook - Cleaning.py" --load-session duplicates.parquet --delete"""
+import sys, os, time, datetime, argparse, csv, json, logging, functools
+import outlook_engine, outlook_cache, outlook_checkpoint, outlook_sources, outlook_stats, outlook_session, outlook_process
+
+class ReportWriter:
+    """Writes result rows (RESULT_COLS, or columns) as they come, in CSV or in JSON Lines (.jsonl / .json, or '-' for stdout).
+    In JSON Lines, each line has a "record" key: "duplicate", "timing", "deletion" or "stats" (the run report, at the end)"""
+    def __init__(self, path, columns=outlook_engine.RESULT_COLS):
+        self.file = sys.stdout if path == "-" else open(path, "w", newline="", encoding="utf-8")
+        self.jsonl = path == "-" or os.path.splitext(path)[1].lower() in (".jsonl", ".json")
+        self.columns = columns
+        if not self.jsonl:
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(self.columns)
+
+    def write_row(self, row):
+        values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in row]
+        if self.jsonl:
+            self.write_record("duplicate", **dict(zip(self.columns, values)))
+        else:
+            self.csv.writerow(values)
+        self.file.flush()
+
+    def write_record(self, record, **values): #Other information (timings, deletion results), in JSON Lines only
+        if self.jsonl:
+            self.file.write(json.dumps({"record": record, **values}, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+class StepTimer:
+    """newStep callback that logs the duration of each step, and reports it"""
+    def __init__(self, report):
+        self.report = report
+        self.start = self.step_start = time.perf_counter()
+        self.step = None
+
+    def __call__(self, text, minimum=0, maximum=100):
+        self.end_step()
+        self.step, self.step_start = text, time.perf_counter()
+        logging.info(text)
+
+    def end_step(self):
+        if self.step is not None:
+            seconds = time.perf_counter() - self.step_start
+            logging.info(f"{self.step}: {seconds:.1f} s")
+            self.report.write_record("timing", step=self.step, seconds=round(seconds, 3))
+        self.step = None
+
+class OutlookConnection:
+    """Connection to Outlook for the batch mode, as MainWindow.get_outlook_dispatch does for the user interface"""
+    def __init__(self, accountName):
+        self.accountName = accountName
+        self.namespace = None
+
+    def get_namespace(self, reconnect=False):
+        if self.namespace is not None and reconnect:
+            try:
+                self.namespace.Folders[self.accountName]
+                return self.namespace #Connection is OK
+            except Exception:
+                logging.debug("Com_error. We try to reconnect")
+        if self.namespace is None or reconnect:
+            import win32com.client, pythoncom #pip install pywin32
+            pythoncom.CoInitialize()
+            try:
+                outlook = win32com.client.gencache.EnsureDispatch("Outlook.Application") #Early binding
+            except Exception:
+                outlook = win32com.client.Dispatch("Outlook.Application") #Late binding
+            self.namespace = outlook.GetNamespace("MAPI")
+        return self.namespace
+
+def parse_args(argv, folder_size_limit, excluded_folders, include_subfolders, workers, near_threshold=0.9, reader_process=False):
+    parser = argparse.ArgumentParser(prog="Outlook - Cleaning.py", description="Search duplicate messages without user interface")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--mailbox", help="Display name of the Outlook mailbox to scan")
+    source.add_argument("--archive", help="Maildir, mbox file, or directory of .eml files to scan instead of Outlook")
+    source.add_argument("--load-session", metavar="SESSION", help="Results saved by --session (or Save in the user interface) to report or delete, without searching again")
+    parser.add_argument("--output", default="-", help="Report file: .csv, or .jsonl for JSON Lines (default: JSON Lines on stdout)")
+    parser.add_argument("--session", help="Also save the results with their StoreID, to reload them later: .parquet or .arrow (needs pyarrow), or .csv")
+    parser.add_argument("--exclude", action="append", default=list(excluded_folders), metavar="FOLDER", help="Folder name not to scan (repeatable)")
+    parser.add_argument("--no-subfolders", dest="include_subfolders", action="store_false", default=include_subfolders, help="Scan only the top folder")
+    parser.add_argument("--size-limit", type=int, default=folder_size_limit, help="Folders with more items are read by windows of dates of that size")
+    parser.add_argument("--workers", type=int, default=workers, help="Number of processes comparing conversations")
+    parser.add_argument("--no-copies", dest="copies", action="store_false", help="Do not search exact copies of messages in other folders")
+    parser.add_argument("--near", nargs="?", type=float, const=near_threshold, metavar="THRESHOLD",
+        help=f"Also search messages almost contained in a newer one (needs NumPy). Only the ones of similarity THRESHOLD (default {near_threshold}) or more are deleted")
+    parser.add_argument("--deleted-folder", default="Deleted Items", help="Name of the deleted items folder of an archive")
+    parser.add_argument("--rebuild-cache", action="store_true", help="Read again all messages from Outlook, instead of the scan cache")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the scan cache")
+    parser.add_argument("--in-process", dest="reader_process", action="store_false", default=None,
+        help="Read the mailbox in this process, instead of a reader process restarted if it fails")
+    parser.add_argument("--reader-process", dest="reader_process", action="store_true", default=None,
+        help="Read the archive in a reader process (archives are read in this process by default)")
+    parser.add_argument("--restart", action="store_true", help="Do not resume the last search if it was interrupted")
+    parser.add_argument("--report", help="JSON file of the run report: stage times, folder throughput, COM call latencies, comparison counts")
+    parser.add_argument("--delete", action="store_true", help="Move all the reported messages (the ones selected, for a session) to Deleted Items (Outlook only)")
+    args = parser.parse_args(argv)
+    if args.delete and args.archive:
+        parser.error("--delete is only available with --mailbox")
+    if args.reader_process is None: #No COM call to isolate in an archive: the reader process is only worth its start for Outlook
+        args.reader_process = reader_process and not args.archive
+    return args
+
+def main(argv, folder_size_limit, excluded_folders, include_subfolders, workers, scan_cache, cache_max_entries, delete_retries, body_banners,
+        scan_checkpoint=None, checkpoint_interval=30, near_threshold=0.9, reader_process=False):
+    """Runs a search (and the deletion if requested). Returns the exit code: 0, or 1 if some messages could not be deleted"""
+    args = parse_args(argv, folder_size_limit, excluded_folders, include_subfolders, workers, near_threshold, reader_process)
+    outlook_engine.set_body_rules(outlook_engine.body_rules(body_banners))
+    report = ReportWriter(args.output, outlook_engine.MAILBOX_COLS if args.load_session else outlook_engine.RESULT_COLS)
+    timer = StepTimer(report)
+    stats = outlook_stats.RunStats(mailbox=args.mailbox, archive=args.archive, session=args.load_session, workers=args.workers)
+    session, connection = None, None
+    try:
+        targets = {} #mailbox: [(row, EntryID, folderName)] of the messages to delete: the reported ones, but the near duplicates to review
+        if args.load_session:
+            timer(f"Loading {args.load_session}...")
+            metadata = outlook_session.read_metadata(args.load_session)
+            StoreIDs, total_count = metadata["StoreIDs"], metadata["total_count"]
+            for rows in outlook_session.iter_session(args.load_session):
+                for row in rows:
+                    report.write_row(row)
+                    if row[8] and row[-2] != "to review": #Selected when it was saved
+                        targets.setdefault(row[0], []).append((len(targets.get(row[0], ())), row[3], row[1]))
+        else:
+            timer("Counting emails...")
+            if args.reader_process: #Read by a child process, restarted if it fails or stalls (see outlook_process)
+                if args.archive:
+                    factory = functools.partial(outlook_sources.OfflineSource, args.archive, args.exclude, args.include_subfolders, args.deleted_folder)
+                else:
+                    factory = functools.partial(outlook_process.open_outlook, args.mailbox, args.exclude, args.include_subfolders, args.size_limit,
+                        None if args.no_cache else scan_cache, cache_max_entries, args.rebuild_cache)
+                source = outlook_process.ProcessSource(factory)
+            elif args.archive:
+                source = outlook_sources.OfflineSource(args.archive, args.exclude, args.include_subfolders, args.deleted_folder)
+            else:
+                connection = OutlookConnection(args.mailbox)
+                source = outlook_sources.OutlookSource(connection.get_namespace(), args.mailbox, args.exclude, args.include_subfolders, args.size_limit)
+                if scan_cache and not args.no_cache:
+                    source.cache = outlook_cache.ScanCache(scan_cache, cache_max_entries, args.rebuild_cache)
+            mailbox = args.mailbox or args.archive
+            StoreIDs = {mailbox: None if args.archive else source.storeID} #Messages of an archive can't be deleted
+            checkpoint = outlook_checkpoint.ScanCheckpoint(scan_checkpoint, checkpoint_interval, not args.restart) if scan_checkpoint else None
+            mailboxTargets = targets.setdefault(mailbox, [])
+            new_session = lambda: outlook_session.SessionWriter(args.session, outlook_session.search_metadata(StoreIDs, source.total_count,
+                copies=args.copies, near_threshold=args.near))
+            for row in outlook_engine.iter_duplicates(source, timer, lambda n: None, lambda: False, args.workers, stats, args.copies, checkpoint, args.near):
+                report.write_row(row)
+                if args.session:
+                    session = session or new_session() #Opened with the first row: all folders are read, total_count is known
+                    session.write_row((mailbox,) + row[:7] + (row[-2] != "to review",) + row[8:]) #toDelete: selected as by --delete
+                if row[-2] != "to review":
+                    mailboxTargets.append((len(mailboxTargets), row[2], row[0]))
+            if args.session and session is None: #No duplicates: the session is saved empty
+                session = new_session()
+            total_count = source.total_count
+        timer.end_step()
+        count = sum(map(len, targets.values()))
+        logging.info(f"{count} messages can be deleted, out of {total_count}")
+        failed = set()
+        if args.delete:
+            if any(StoreIDs[mailbox] is None for mailbox in targets):
+                raise SystemExit(f"{args.load_session} was saved from an archive: its messages can't be deleted")
+            timer(f"Deleting {count} messages...")
+            stats.new_stage("delete")
+            deleted = set()
+            connection = connection or OutlookConnection(next(iter(StoreIDs)))
+            for mailbox, mailboxTargets in targets.items(): #Messages are found by EntryID in the store of their mailbox
+                mailboxDeleted, mailboxFailed = outlook_sources.delete_outlook_messages(mailboxTargets, connection.get_namespace,
+                    StoreIDs[mailbox], lambda n: None, lambda: False, delete_retries, stats)
+                deleted |= {(mailbox, row) for row in mailboxDeleted}
+                failed |= {(mailbox, row) for row in mailboxFailed}
+            stats.end_stage()
+            timer.end_step()
+            report.write_record("deletion", deleted=len(deleted), failed=len(failed))
+            logging.info(f"{len(deleted)} messages deleted, {len(failed)} could not be deleted")
+        report.write_record("timing", step="Total", seconds=round(time.perf_counter() - timer.start, 3))
+        report.write_record("stats", **stats.report())
+        if args.report:
+            stats.save(args.report)
+    finally:
+        report.close()
+        if session is not None:
+            session.close()
+    return 1 if failed else 0
@@ -0,0 +1,429 @@
+"""Benchmark of the search stages of Outlook - Cleaning.py, without Outlook: runs on any OS against a fake COM object model.
+generate_mailbox builds a synthetic mailbox (FakeNamespace), read by outlook_sources.OutlookSource as a real one.
+Example:
+    python outlook_benchmark.py --sizes 1000 10000 100000 --workers 4 --output benchmark.json"""
+import sys, re, time, random, datetime, json, argparse, tracemalloc, functools
+import outlook_engine, outlook_sources, outlook_stats
+
+DEFAULT_FOLDER_NAMES = {outlook_sources.OL_FOLDER_DELETED_ITEMS: "Deleted Items", 20: "Sync Issues", 10: "Contacts", 16: "Drafts",
+    11: "Journal", 25: "RSS Feeds"} #Folders returned by GetDefaultFolder
+FOLDER_NAMES = ["Inbox", "Sent Items", "Projects", "Archive"] #Folders where conversations are stored, besides Deleted Items
+WORDS = ("meeting budget report project review draft planning update contract invoice delivery schedule customer supplier "
+    "agenda minutes action deadline quality release test issue request approval team please thanks regards").split()
+
+class FakeAttachment:
+    def __init__(self, name):
+        self.FileName = self.DisplayName = name
+        self.Type = 1 #olByValue
+
+class FakeMailItem:
+    """MailItem with the properties read by OutlookSource. Receipts have no SenderName, as undelivered or recalled messages in Outlook"""
+    def __init__(self, namespace, folder, date, subject, topic, conversationID, conversationIndex, sender, body, atts, receipt=False, unread=False):
+        self.namespace, self.Parent = namespace, folder
+        self.EntryID = f"{len(namespace.items):08X}"
+        self.CreationTime = self.LastModificationTime = date
+        self.Subject, self.ConversationTopic, self.ConversationID, self.ConversationIndex = subject, topic, conversationID, conversationIndex
+        self.UnRead = unread
+        self.SenderEmailAddress = sender
+        if receipt:
+            self.MessageClass = "REPORT.IPM.Note.NDR"
+        else:
+            self.MessageClass = "IPM.Note"
+            self.SenderName = sender.split("@")[0].replace(".", " ").title()
+        self.Body = body
+        self.Attachments = [FakeAttachment(name) for name in atts]
+        self.Size = len(body) + 2000 + 50000 * len(atts)
+
+    def Delete(self): #Moves the item to Deleted Items, or deletes it permanently from there
+        del self.Parent.Items.items[self.EntryID]
+        deleted = self.namespace.GetDefaultFolder(outlook_sources.OL_FOLDER_DELETED_ITEMS)
+        if self.Parent is deleted:
+            del self.namespace.items[self.EntryID]
+        else:
+            self.Parent = deleted
+            deleted.Items.items[self.EntryID] = self
+
+class FakeItems:
+    """Items of a folder, by EntryID in the order of the collection"""
+    RESTRICT_FILTER = re.compile(r"\[CreationTime\] >= '([^']+)' AND \[CreationTime\] < '([^']+)'") #Filters built by FolderWindow
+
+    def __init__(self, items):
+        self.items = items
+
+    @property
+    def Count(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(list(self.items.values()))
+
+    def Sort(self, property):
+        items = sorted(self.items.values(), key=lambda item: getattr(item, property.strip("[]")))
+        self.items = {item.EntryID: item for item in items}
+
+    def GetFirst(self):
+        return next(iter(self.items.values()))
+
+    def GetLast(self):
+        return next(reversed(self.items.values()))
+
+    def Restrict(self, filter):
+        start, end = (datetime.datetime.strptime(date, outlook_sources.RESTRICT_DATE_FORMAT) for date in self.RESTRICT_FILTER.match(filter).groups())
+        return FakeItems({ID: item for ID, item in self.items.items() if start <= item.CreationTime.replace(second=0, microsecond=0) < end})
+
+class FakeColumns:
+    def __init__(self):
+        self.names = []
+
+    def RemoveAll(self):
+        self.names = []
+
+    def Add(self, name):
+        self.names.append(name)
+
+class FakeTable:
+    """Table returned by Folder.GetTable: rows of the Columns properties, read by batches with GetArray"""
+    def __init__(self, items):
+        self.items, self.position = items, 0
+        self.Columns = FakeColumns()
+
+    @property
+    def EndOfTable(self):
+        return self.position >= len(self.items)
+
+    def GetArray(self, count):
+        rows = self.items[self.position:self.position+count]
+        self.position += len(rows)
+        return tuple(tuple(com_value(getattr(item, name, None)) for name in self.Columns.names) for item in rows)
+
+def com_value(value):
+    """Copy of a string, as COM returns a new string at each call: the same sender read twice is stored twice, unless interned"""
+    return (value + " ")[:-1] if isinstance(value, str) else value
+
+class FakeFolders(list):
+    def __getitem__(self, key): #Folders are indexed by position or by name, as in Outlook
+        if isinstance(key, str):
+            for folder in self:
+                if folder.Name == key:
+                    return folder
+            raise KeyError(key)
+        return super().__getitem__(key)
+
+class FakeFolder:
+    count = 0 #Folders created, to number their EntryID
+
+    def __init__(self, name, storeID, messageClass="IPM.Note"):
+        self.Name, self.StoreID, self.DefaultMessageClass = name, storeID, messageClass
+        FakeFolder.count += 1
+        self.EntryID = f"FOLDER{FakeFolder.count:08X}"
+        self.Items = FakeItems({})
+        self.Folders = FakeFolders()
+
+    def GetTable(self, filter=None):
+        return FakeTable(list((self.Items.Restrict(filter) if filter else self.Items).items.values()))
+
+class FakeNamespace:
+    """MAPI namespace of a single mailbox accountName"""
+    def __init__(self, accountName="benchmark@example.com"):
+        self.storeID = "FAKESTORE"
+        self.top_folder = FakeFolder(accountName, self.storeID)
+        self.Folders = FakeFolders([self.top_folder])
+        self.default_folders = {id: FakeFolder(name, self.storeID) for id, name in DEFAULT_FOLDER_NAMES.items()}
+        self.top_folder.Folders.append(self.default_folders[outlook_sources.OL_FOLDER_DELETED_ITEMS])
+        self.items = {} #EntryID: FakeMailItem
+
+    def GetDefaultFolder(self, id):
+        return self.default_folders[id]
+
+    def GetItemFromID(self, ID, storeID=None):
+        return self.items[ID]
+
+    def add_folder(self, name, parent=None):
+        folder = FakeFolder(name, self.storeID)
+        (parent or self.top_folder).Folders.append(folder)
+        return folder
+
+    def add_item(self, folder, *args, **kwargs):
+        item = FakeMailItem(self, folder, *args, **kwargs)
+        self.items[item.EntryID] = item
+        folder.Items.items[item.EntryID] = item
+        return item
+
+def generate_mailbox(nb_messages, seed=0, mean_conversation=3.0, fork_rate=0.1, attachment_churn=0.2, receipt_rate=0.02, deleted_rate=0.1,
+        copy_rate=0.02, rewrap_rate=0.0, folder_names=FOLDER_NAMES, accountName="benchmark@example.com"):
+    """Returns a FakeNamespace of about nb_messages messages:
+    - conversation lengths follow a geometric distribution of mean mean_conversation (capped at 50)
+    - a reply quotes its parent. The parent is the previous message, or with probability fork_rate an older one (fork).
+        ConversationIndex is built as in Outlook: 22 bytes for the first message, and 5 more bytes for each reply level
+    - with probability attachment_churn, a reply removes or adds an attachment
+    - receipt_rate of the messages are undelivered receipts (a tenth of them unread), and deleted_rate are in Deleted Items
+    - copy_rate of the messages are also copied in another folder, e.g. by a PST import
+    - with probability rewrap_rate, a reply re-wraps the quoted text with "> " prefixes: only outlook_similarity finds it
+    - quoted texts sometimes get a confidentiality banner or a <mailto:> link, removed by outlook_engine.normalize_body"""
+    rng = random.Random(seed)
+    namespace = FakeNamespace(accountName)
+    folders = [namespace.add_folder(name) for name in folder_names]
+    folders.append(namespace.add_folder("2023", folders[-1])) #A sub-folder
+    deleted = namespace.GetDefaultFolder(outlook_sources.OL_FOLDER_DELETED_ITEMS)
+    senders = [f"{first}.{last}@example.com" for first in ("john", "jane", "paul", "anna", "mark", "lucy") for last in ("doe", "smith", "martin")]
+    start = datetime.datetime(2021, 1, 1)
+    count = 0
+    while count < nb_messages:
+        length = min(50, nb_messages - count, 1 + int(rng.expovariate(1 / max(mean_conversation - 1, 0.01))))
+        topic = " ".join(rng.choices(WORDS, k=4)).capitalize()
+        conversationID = f"{rng.getrandbits(64):016X}"
+        date = start + datetime.timedelta(minutes=rng.randrange(3 * 365 * 24 * 60))
+        atts = sorted(rng.sample(["report.pdf", "budget.xlsx", "slides.pptx", "notes.docx", "image001.png"], rng.randrange(3)))
+        posted = [] #(body, atts, conversationIndex) of the messages of the conversation
+        for i in range(length):
+            sender = rng.choice(senders)
+            text = " ".join(rng.choices(WORDS, k=rng.randrange(10, 60)))
+            if not posted:
+                body, subject = f"Hello,\r\n{text}\r\nRegards", topic
+                index = f"{rng.getrandbits(176):044X}"
+            else:
+                parent = posted[-1] if rng.random() >= fork_rate else rng.choice(posted)
+                quoted = parent[0]
+                if rng.random() < 0.1:
+                    quoted = quoted.replace("Regards", f"Regards <mailto:{sender}>", 1) #Link inserted in the quoted text
+                if rng.random() < 0.1:
+                    quoted = "C1 - Internal use\r\n" + quoted
+                if rewrap_rate and rng.random() < rewrap_rate: #Drawn only if needed, so that other mailboxes don't change
+                    words = quoted.split(" ")
+                    quoted = "> " + " ".join(word + ("\r\n>" if i % 9 == 8 else "") for i, word in enumerate(words))
+                body = f"{text}\r\n\r\nFrom: {sender}\r\nSent: {date:%A, %B %d, %Y %I:%M %p}\r\nSubject: {topic}\r\n\r\n  {quoted}"
+                subject = "RE: " + topic
+                index = parent[2] + f"{rng.getrandbits(40):010X}"
+                atts = list(parent[1])
+                if rng.random() < attachment_churn:
+                    if atts and rng.random() < 0.5:
+                        atts.remove(rng.choice(atts))
+                    else:
+                        atts = sorted(atts + [f"attachment{i}.pdf"])
+            posted.append((body, atts, index))
+            folder = deleted if rng.random() < deleted_rate else rng.choice(folders)
+            namespace.add_item(folder, date, subject, topic, conversationID, index, sender, body, atts)
+            if count + 1 < nb_messages and rng.random() < copy_rate:
+                namespace.add_item(rng.choice(folders), date, subject, topic, conversationID, index, sender, body, atts)
+                count += 1
+            date += datetime.timedelta(minutes=rng.randrange(1, 3 * 24 * 60))
+            count += 1
+            if count < nb_messages and rng.random() < receipt_rate:
+                namespace.add_item(rng.choice(folders), date, "Undeliverable: " + subject, topic, conversationID, "", "postmaster@example.com",
+                    "Delivery has failed to these recipients", [], receipt=True, unread=rng.random() < 0.1)
+                count += 1
+    return namespace
+
+def benchmark_source(nb_messages, seed=0, folder_size_limit=20000, use_table=True, **profile):
+    """OutlookSource of a synthetic mailbox. Also a factory of outlook_process.ProcessSource: the same mailbox is generated in the reader process"""
+    namespace = generate_mailbox(nb_messages, seed, **profile)
+    source = outlook_sources.OutlookSource(namespace, namespace.top_folder.Name, [], True, folder_size_limit)
+    source.use_table = use_table
+    return source
+
+class StageMeter:
+    """Measures the wall time, throughput and memory of the benchmark stages"""
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.results = {}
+
+    def run(self, stage, function, *args):
+        """Runs function(*args), which returns (result, number of messages treated)"""
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result, count = function(*args)
+        seconds = time.perf_counter() - start
+        peak = None
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.results[stage] = {"seconds": round(seconds, 4), "messages": count, "messages_per_s": round(count / seconds) if seconds else None,
+            "peak_memory_MB": round(peak / 2**20, 1) if peak is not None else None}
+        return result
+
+def ignore(*args, **kwargs):
+    pass
+
+def run_benchmark(nb_messages, seed=0, workers=1, use_table=True, trace_memory=True, folder_size_limit=20000, near_threshold=None, reader_process=False,
+        **profile):
+    """Times the stages of outlook_engine.search_duplicates on a synthetic mailbox, then the deletion of all the results.
+    Returns {"messages", "duplicates", "stages": {stage: {"seconds", "messages", "messages_per_s", "peak_memory_MB"}}, "calls"},
+    calls being the latencies of the fake COM calls recorded by the source, and compare the comparison counts (see outlook_stats).
+    peak_memory_MB is measured with tracemalloc, which slows down the stages. trace_memory=False gives more precise times.
+    With a near_threshold, all bodies are read, and a "similar" stage searches near duplicates (see outlook_similarity).
+    With reader_process, the mailbox is read by an outlook_process.ProcessSource, with its own copy of the mailbox"""
+    namespace = generate_mailbox(nb_messages, seed, **profile)
+    if reader_process:
+        import outlook_process
+        source = outlook_process.ProcessSource(functools.partial(benchmark_source, nb_messages, seed, folder_size_limit, use_table, **profile))
+    else:
+        source = outlook_sources.OutlookSource(namespace, namespace.top_folder.Name, [], True, folder_size_limit)
+        source.use_table = use_table
+    source.lazy = near_threshold is None
+    meter = StageMeter(trace_memory)
+    receipts = []
+    store = outlook_engine.MessageStore()
+    compare_stats = outlook_stats.RunStats() #Counts of the comparison
+
+    def read():
+        folderLists = list(outlook_engine.read_folders(source, ignore, ignore, lambda: False))
+        return folderLists, sum(map(len, folderLists))
+
+    def copies(subLists):
+        return outlook_engine.find_copies(subLists, store, source, ignore, ignore, lambda: False), sum(map(len, subLists))
+
+    def fetch(subLists):
+        subLists = outlook_engine.fetch_contents(subLists, store, source, ignore, ignore, lambda: False)
+        return subLists, source.contents_read
+
+    def normalize(bodies):
+        return [outlook_engine.normalize_body(body) for body in bodies], len(bodies)
+
+    def compare(subLists):
+        count = sum(map(len, subLists))
+        return list(outlook_engine.compare_stage(subLists, store, source.deleted_folder, ignore, lambda: False, workers, compare_stats)), count
+
+    def similar(reported):
+        import outlook_similarity
+        return outlook_similarity.find_similar(store, reported, source.deleted_folder, near_threshold, ignore, ignore, lambda: False), len(store)
+
+    def delete(targets):
+        return outlook_sources.delete_outlook_messages(targets, lambda reconnect: namespace, source.storeID, ignore, lambda: False), len(targets)
+
+    folderLists = meter.run("read", read)
+    subLists = meter.run("group", lambda: (outlook_engine.group_conversations(folderLists, receipts, store), source.total_count))
+    del folderLists
+    receipts += meter.run("copies", copies, subLists)
+    subLists = meter.run("fetch", fetch, subLists)
+    source.close(True) #Stops the reader process, and merges the latencies of its calls
+    meter.run("normalize", normalize, [namespace.items[store.ID[row]].Body for subList in subLists for row in subList])
+    rows = receipts + meter.run("compare", compare, subLists)
+    del subLists
+    if near_threshold is not None:
+        rows += meter.run("similar", similar, {row[2] for row in rows})
+    meter.run("delete", delete, [(row, mess[2], mess[0]) for row, mess in enumerate(rows)])
+    return {"messages": source.total_count, "duplicates": len(rows), "stages": meter.results, "calls": source.stats.report()["calls"],
+        "compare": dict(compare_stats.compare)}
+
+def memory_benchmark(nb_messages, seed=0, folder_size_limit=20000, **profile):
+    """Memory of all the messages of a synthetic mailbox with their bodies, once read and grouped by conversation:
+    as lists of Message tuples (the layout before MessageStore), and in a MessageStore with arrays of rows.
+    Returns {"messages", "tuples_MB", "store_MB"}, measured with tracemalloc"""
+    namespace = generate_mailbox(nb_messages, seed, **profile)
+    results = {"messages": 0}
+    for layout in ("tuples", "store"):
+        source = outlook_sources.OutlookSource(namespace, namespace.top_folder.Name, [], True, folder_size_limit)
+        source.lazy = False #Bodies and attachments read with the other properties
+        tracemalloc.start()
+        folderLists = outlook_engine.read_folders(source, ignore, ignore, lambda: False)
+        if layout == "tuples":
+            conversations = {}
+            for folderMessages in folderLists:
+                for mess in sorted((mess for mess in folderMessages if not mess.toDelete), key=lambda mess: mess.date):
+                    conversations.setdefault(mess.conversationID, []).append(mess)
+            subLists = list(conversations.values())
+            del conversations
+        else:
+            store = outlook_engine.MessageStore()
+            subLists = outlook_engine.group_conversations(folderLists, [], store)
+        results[f"{layout}_MB"] = round(tracemalloc.get_traced_memory()[0] / 2**20, 1)
+        tracemalloc.stop()
+        results["messages"] = source.total_count
+        del subLists
+    del store
+    return results
+
+def legacy_normalize(body, banners=outlook_engine.BODY_BANNERS):
+    """Body normalization of the first version: remove_mailtos, remove_urls, then find_replace_text for each banner, one pass each.
+    Reference of normalize_benchmark and of tests/test_normalize.py"""
+    body = ''.join([line.strip() for line in body.splitlines()])
+    if "<mailto:" in body: #remove_mailtos
+        mailtos = re.findall(r" <mailto:[\w.\-]+@[\w.\-]+.\w+> ?", body)
+        for mailto in dict.fromkeys(mailtos):
+            body = body.replace(mailto, '')
+    if " <http" in body: #remove_urls
+        nb_char_deleted = 0
+        for url in re.finditer(r" <https?:\/\/[\w.\-\+\/]+> ?", body):
+            url_bare = url.group()[2:-1]
+            if url_bare[-1] == ">":
+                url_bare = url_bare[:-1]
+            pos = body[:url.start()-nb_char_deleted].rfind(url_bare)
+            if pos != -1 and pos + len(url_bare) == url.start() - nb_char_deleted:
+                body = body[:url.start()-nb_char_deleted] + body[url.end()-nb_char_deleted:]
+                nb_char_deleted += url.end() - url.start()
+    for banner in banners: #find_replace_text
+        while True:
+            pos = body.find(banner)
+            if pos == -1:
+                break
+            body = body[:pos] + body[pos+len(banner):]
+    return body
+
+def normalize_benchmark(nb_messages, seed=0, repeat=3, **profile):
+    """Times legacy_normalize and outlook_engine.normalize_body (BodyNormalizer) on the bodies of a synthetic mailbox, best of repeat runs.
+    Returns {"bodies", "legacy_s", "normalizer_s", "different"}, different being the number of bodies they normalize differently"""
+    namespace = generate_mailbox(nb_messages, seed, **profile)
+    bodies = [item.Body for item in namespace.items.values()]
+    results = {"bodies": len(bodies)}
+    for name, normalize in (("legacy", legacy_normalize), ("normalizer", outlook_engine.normalize_body)):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            normalized = [normalize(body) for body in bodies]
+            times.append(time.perf_counter() - start)
+        results[f"{name}_s"] = round(min(times), 4)
+        results[name] = normalized
+    results["different"] = sum(a != b for a, b in zip(results.pop("legacy"), results.pop("normalizer")))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the search stages on synthetic mailboxes, without Outlook")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Numbers of messages of the mailboxes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes comparing conversations")
+    parser.add_argument("--mean-conversation", type=float, default=3.0, help="Mean number of messages per conversation")
+    parser.add_argument("--fork-rate", type=float, default=0.1, help="Probability that a reply answers an older message than the last one")
+    parser.add_argument("--attachment-churn", type=float, default=0.2, help="Probability that a reply removes or adds an attachment")
+    parser.add_argument("--receipt-rate", type=float, default=0.02, help="Proportion of undelivered receipts")
+    parser.add_argument("--deleted-rate", type=float, default=0.1, help="Proportion of messages in Deleted Items")
+    parser.add_argument("--copy-rate", type=float, default=0.02, help="Proportion of messages copied in another folder")
+    parser.add_argument("--rewrap-rate", type=float, default=0.0, help="Probability that a reply re-wraps the quoted text")
+    parser.add_argument("--near", type=float, metavar="THRESHOLD", help="Also search near duplicates, selected above THRESHOLD (needs NumPy)")
+    parser.add_argument("--no-reply-tree", action="store_true", help="Compare messages in conversation order, without ConversationIndex")
+    parser.add_argument("--no-table", action="store_true", help="Read messages one by one instead of Folder.GetTable")
+    parser.add_argument("--reader-process", action="store_true", help="Read the mailbox in a child process, as with READER_PROCESS")
+    parser.add_argument("--no-memory", action="store_true", help="Do not trace memory, for more precise times")
+    parser.add_argument("--memory-layout", action="store_true", help="Only compare the memory of the messages as tuples and in a MessageStore")
+    parser.add_argument("--normalize", action="store_true", help="Only time the body normalization, against the one of the first version")
+    parser.add_argument("--output", help="JSON file of the results")
+    args = parser.parse_args(argv)
+    outlook_engine.USE_REPLY_TREE = not args.no_reply_tree
+    results = []
+    profile = dict(mean_conversation=args.mean_conversation, fork_rate=args.fork_rate, attachment_churn=args.attachment_churn,
+        receipt_rate=args.receipt_rate, deleted_rate=args.deleted_rate, copy_rate=args.copy_rate, rewrap_rate=args.rewrap_rate)
+    for size in args.sizes:
+        if args.memory_layout:
+            result = memory_benchmark(size, args.seed, **profile)
+            results.append(result)
+            print(f"{result['messages']} messages: {result['tuples_MB']} MB as Message tuples, {result['store_MB']} MB in a MessageStore")
+            continue
+        if args.normalize:
+            result = normalize_benchmark(size, args.seed, **profile)
+            results.append(result)
+            print(f"{result['bodies']} bodies: {result['legacy_s']:.3f} s with the first version, {result['normalizer_s']:.3f} s with BodyNormalizer, "
+                f"{result['different']} normalized differently")
+            continue
+        result = run_benchmark(size, args.seed, args.workers, not args.no_table, not args.no_memory, near_threshold=args.near,
+            reader_process=args.reader_process, **profile)
+        results.append(result)
+        print(f"{result['messages']} messages, {result['duplicates']} duplicates, {result['compare'].get('text_compares', 0)} containment tests")
+        for stage, values in result["stages"].items():
+            memory = f"{values['peak_memory_MB']:>8} MB" if values["peak_memory_MB"] is not None else ""
+            print(f"    {stage:<10}{values['seconds']:>9.3f} s{values['messages_per_s'] or 0:>10} msg/s{memory}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"arguments": vars(args), "python": sys.version, "results": results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""On-disk cache of scanned messages, used by Outlook - Cleaning.py to re-read only new or modified messages.
+Entries are keyed by (StoreID, EntryID) and are valid as long as the LastModificationTime of the message did not change."""
+import sqlite3, json, time, datetime, logging
+from outlook_engine import Message, MESSAGE_COLS
+
+COMMIT_WRITES = 1000 #Writes between two commits, so that searches of other mailboxes in other threads can write too
+
+class ScanCache:
+    """SQLite cache of Message records. Must be used in the thread that created it (sqlite3 restriction).
+    Several caches can use the same file at once, e.g. to search several mailboxes in parallel"""
+    COLS = ["storeID", "entryID", "modified", "lastSeen"] + MESSAGE_COLS
+
+    def __init__(self, path, max_entries=200000, rebuild=False):
+        self.path = path
+        self.max_entries = max_entries #Older entries are evicted above this number
+        self.scan_start = time.time() #Entries not seen since scan_start are dropped by purge()
+        self.hits, self.misses = 0, 0
+        self.writes = 0 #Since the last commit
+        self.connection = sqlite3.connect(path, timeout=60) #Waits for the commit of another search
+        self.connection.execute("PRAGMA journal_mode=WAL") #Readers don't wait for writers
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(messages)")]
+        if rebuild or columns and columns != self.COLS: #Also rebuilt when Message has new fields
+            self.connection.execute("DROP TABLE IF EXISTS messages")
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS messages ({', '.join(self.COLS)}, PRIMARY KEY (storeID, entryID))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS messages_lastSeen ON messages (lastSeen)")
+
+    def get(self, storeID, entryID, modified, folderName):
+        """Returns the cached Message, or None if it is unknown or was modified since it was cached"""
+        row = self.connection.execute("SELECT * FROM messages WHERE storeID=? AND entryID=?", (storeID, entryID)).fetchone()
+        if row is None or row[2] != str(modified):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute("UPDATE messages SET lastSeen=? WHERE storeID=? AND entryID=?", (time.time(), storeID, entryID))
+        self.written()
+        mess = Message._make(row[4:])
+        return mess._replace(folderName=folderName, date=datetime.datetime.fromisoformat(mess.date), isUnread=bool(mess.isUnread),
+            toDelete=bool(mess.toDelete), atts=json.loads(mess.atts)) #folderName is taken from the current scan, in case the message moved
+
+    def put(self, storeID, modified, mess):
+        values = mess._replace(date=mess.date.isoformat(), atts=json.dumps(list(mess.atts)))
+        self.connection.execute(f"INSERT OR REPLACE INTO messages VALUES ({', '.join('?' * len(self.COLS))})",
+            (storeID, mess.ID, str(modified), time.time()) + tuple(values))
+        self.written()
+
+    def touch(self, storeID, entryIDs):
+        """Marks the messages entryIDs as seen by this scan, without reading them, e.g. the ones of a folder resumed from a checkpoint"""
+        now = time.time()
+        self.connection.executemany("UPDATE messages SET lastSeen=? WHERE storeID=? AND entryID=?", ((now, storeID, ID) for ID in entryIDs))
+        self.written()
+
+    def written(self): #Commits every COMMIT_WRITES writes
+        self.writes += 1
+        if self.writes >= COMMIT_WRITES:
+            self.connection.commit()
+            self.writes = 0
+
+    def purge(self, storeID):
+        """To call after a complete scan of storeID: drops the messages that no longer exist, then evicts the oldest entries above max_entries"""
+        self.connection.execute("DELETE FROM messages WHERE storeID=? AND lastSeen<?", (storeID, self.scan_start))
+        count = self.connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute("DELETE FROM messages WHERE rowid IN (SELECT rowid FROM messages ORDER BY lastSeen LIMIT ?)", (count - self.max_entries,))
+        self.connection.commit()
+        logging.info(f"Scan cache: {self.hits} messages reused, {self.misses} read from Outlook")
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,122 @@
+"""Checkpoint of a search of Outlook - Cleaning.py, so that a scan interrupted by a lost Outlook connection or by Cancel can be resumed.
+The file is a sequence of pickled records: a header, then the messages of each folder read, or once all folders are read,
+the state of the search before comparison followed by the results of each conversation compared.
+A resumed search reuses the folders and conversations completed, and reads again the folder that was in progress.
+The state is reused only if the folders of the mailbox (their keys, with their number of messages) did not change since."""
+import os, re, time, pickle, logging
+
+CHECKPOINT_MAX_AGE = 24 * 3600 #Seconds after which a checkpoint is ignored: the mailbox has probably changed too much
+FORMAT_VERSION = 3 #To change when the records change
+
+def mailbox_path(path, mailbox):
+    """Checkpoint file of mailbox, derived from path, so that mailboxes searched at once have their own checkpoint"""
+    root, ext = os.path.splitext(path)
+    name = re.sub(r"[^\w.@-]+", "_", mailbox)
+    return f"{root}-{name}{ext}"
+
+class ScanCheckpoint:
+    """Checkpoint file of one search. Records are written as they come, and flushed to disk every interval seconds
+    (and when the search ends or fails). The file is deleted once the search completed"""
+    def __init__(self, path, interval=30, resume=True, max_age=CHECKPOINT_MAX_AGE):
+        self.path, self.interval, self.resume, self.max_age = path, interval, resume, max_age
+        self.file = None
+        self.folders = {} #Folder key: Message records, of the folders read by the interrupted search
+        self.state = None #(rows, store, subLists, total_count) of the interrupted search, once all folders were read
+        self.fingerprint = None #Keys of the folders of the mailbox when they were read (see outlook_engine.read_folders)
+        self.compared = {} #Conversation position: result rows, of the conversations compared by the interrupted search
+        self.pending = {} #Conversation position: result rows, not written yet
+
+    def open(self, source, **settings):
+        """Loads the checkpoint left by an interrupted search of the same source with the same settings (e.g. copies=True),
+        and opens it to continue it. Other checkpoints are replaced"""
+        self.header = {"version": FORMAT_VERSION, "storeID": source.storeID, "deleted_folder": source.deleted_folder,
+            "excluded_folders": sorted(getattr(source, "excluded_folders", [])), "include_subfolders": getattr(source, "include_subfolders", True), **settings}
+        end = self.load(self.header) if self.resume else 0
+        if end:
+            self.file = open(self.path, "r+b")
+            self.file.truncate(end) #Drops a last record partially written
+            self.file.seek(end)
+            logging.info(f"Resuming the interrupted search: {len(self.folders)} folders read, {len(self.compared)} conversations compared")
+        else:
+            self.folders, self.state, self.compared = {}, None, {}
+            self.file = open(self.path, "wb")
+            pickle.dump(self.header, self.file)
+        self.last_flush = time.monotonic()
+
+    def load(self, header):
+        """Reads the records of the checkpoint if it matches header. Returns the position of the end of the last complete record, 0 if none"""
+        try:
+            if time.time() - os.path.getmtime(self.path) > self.max_age:
+                return 0
+            with open(self.path, "rb") as f:
+                if pickle.load(f) != header:
+                    return 0
+                end = f.tell()
+                while True:
+                    try:
+                        record = pickle.load(f)
+                    except (EOFError, pickle.UnpicklingError, AttributeError, ValueError): #End of file, or record partially written
+                        return end
+                    if record[0] == "folder":
+                        self.folders[record[1]] = record[2]
+                    elif record[0] == "state":
+                        self.fingerprint, self.state = record[1], record[2:]
+                    elif record[0] == "compared":
+                        self.compared.update(record[1])
+                    end = f.tell()
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError) as e: #Missing, or not a checkpoint
+            logging.debug(f"No checkpoint to resume: {e}")
+            return 0
+
+    def write(self, record):
+        pickle.dump(record, self.file, pickle.HIGHEST_PROTOCOL)
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            results, self.pending = self.pending, {}
+            pickle.dump(("compared", results), self.file, pickle.HIGHEST_PROTOCOL)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_flush = time.monotonic()
+
+    def folder_done(self, key, messages): #All messages of the folder key were read
+        self.write(("folder", key, messages))
+
+    def save_state(self, rows, store, subLists, total_count):
+        """All folders were read: replaces the folder records by the state of the search before comparison.
+        The new file replaces the old one only once complete, so the folders read are not lost if it fails"""
+        self.file.close()
+        with open(self.path + ".tmp", "wb") as f:
+            pickle.dump(self.header, f)
+            pickle.dump(("state", self.fingerprint, rows, store, subLists, total_count), f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self.file = open(self.path, "ab")
+        self.folders = {}
+
+    def discard(self):
+        """Forgets the interrupted search, e.g. if the mailbox changed since its state was saved: this one starts from scratch"""
+        self.folders, self.state, self.compared, self.pending = {}, None, {}, {}
+        self.file.seek(0)
+        self.file.truncate()
+        pickle.dump(self.header, self.file)
+
+    def conversation_done(self, position, rows): #Written with the next record or flush
+        self.pending[position] = rows
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def close(self, completed):
+        if self.file is None:
+            return
+        if not completed:
+            self.flush()
+        self.file.close()
+        self.file = None
+        if completed:
+            os.remove(self.path)
+        else:
+            logging.info(f"Search checkpoint saved in {self.path}")
@@ -0,0 +1,587 @@
+"""Analysis engine of Outlook - Cleaning.py: decides which messages of a conversation are duplicates.
+It works on plain tuples, without pandas, Qt or win32com, so it can run in any thread or process."""
+import bisect, collections, re, heapq, logging, time, datetime, array, queue, concurrent.futures
+import outlook_stats
+
+MESSAGE_COLS = ["folderName", "conversationID", "ID", "date", "subject", "topic", "isUnread", "senderName", "senderMail", "toDelete", "body", "atts", "mess_size", "conversationIndex"]
+COLS_DEL = ['folderName', 'conversationID', 'ID', 'date', 'subject', 'topic', 'senderMail', 'toDelete', 'mess_size']
+NEWER_COLS = ["newerID", "newerFolder", "newerDate"]
+RESULT_COLS = COLS_DEL + NEWER_COLS + ["reason", "similarity"] #Rows returned by search_duplicates. reason is "receipt", "copy", "contained",
+#or for near duplicates (see outlook_similarity) "similar", or "to review" when similarity is below the threshold: these are never selected automatically
+PARALLEL_MIN_MESSAGES = 2000 #Below this number of messages to compare, starting worker processes costs more than it saves
+USE_REPLY_TREE = True #compare_conversation first compares a message to its replies. False to measure the full scan
+MAILBOX_COLS = ["mailbox"] + RESULT_COLS #Rows returned by iter_mailboxes
+STEP = re.compile(r"Step (\d+)/(\d+)") #Number of the step in the texts of newStep, to follow the progress of each mailbox
+Message = collections.namedtuple("Message", MESSAGE_COLS) #One message read in a folder. atts is the sorted list (or tuple) of attachment names
+#conversationIndex locates the message in the reply tree: the conversationIndex of a message starts with the one of its parent
+#(ConversationIndex in Outlook, References in archives). It is empty when unknown
+
+def compare_conversation(messages, deleted_folder, counts=None):
+    """Returns the rows (RESULT_COLS) of the messages of one conversation that are contained in a newer message.
+    Same decisions as the historical loop of search_duplicates_b: a message is contained if a strictly newer message
+    has all its attachments and its full body. A newer message in deleted_folder only counts if the message is also there.
+    Replies of the message (according to conversationIndex) are compared first, as they usually quote it, nearest replies first.
+    Then the other newer messages, in the order of `messages`. The first one that qualifies is reported.
+    counts (a Counter) receives the numbers of conversations, messages, pairs, candidates after pruning, and text comparisons,
+    of which tree_compares with replies (that found tree_matches) and fallback_compares with other messages"""
+    messages = [mess if type(mess) is Message else Message._make(mess) for mess in messages]
+    n = len(messages)
+    if n < 2: #A message alone in its conversation can't be a duplicate
+        return []
+    lengths = [len(mess.body) for mess in messages]
+    attSets = [frozenset(mess.atts) for mess in messages]
+    inDeleted = [mess.folderName == deleted_folder for mess in messages]
+    indexes = [mess.conversationIndex or "" for mess in messages]
+    byDate = sorted(range(n), key=lambda i: messages[i].date) #positions, oldest first
+    newer = [] #(body length, position) of messages strictly more recent than the ones being compared, sorted by length
+    containers = [None] * n
+    nb_candidates, nb_texts, nb_tree, nb_tree_matches = 0, 0, 0, 0
+    end = n
+    while end > 0: #Walk from the newest to the oldest messages, one group of identical dates at a time
+        start = end - 1
+        while start > 0 and messages[byDate[start-1]].date == messages[byDate[end-1]].date:
+            start -= 1
+        for i in byDate[start:end]:
+            first = bisect.bisect_left(newer, (lengths[i], -1)) #A shorter body can't contain mess.body
+            candidates = sorted(pos for length, pos in newer[first:] #Prune on folder and attachments before comparing text
+                if (inDeleted[i] or not inDeleted[pos]) and attSets[i] <= attSets[pos])
+            nb_candidates += len(candidates)
+            index, replies = indexes[i], []
+            if index and USE_REPLY_TREE: #Replies first, then the other candidates
+                replies = [pos for pos in candidates if len(indexes[pos]) > len(index) and indexes[pos].startswith(index)]
+                if replies:
+                    replySet = set(replies)
+                    replies.sort(key=lambda pos: len(indexes[pos])) #Nearest replies first. Stable: then in the order of messages
+                    candidates = replies + [pos for pos in candidates if pos not in replySet]
+            for rank, pos in enumerate(candidates):
+                nb_texts += 1
+                nb_tree += rank < len(replies)
+                if messages[i].body in messages[pos].body:
+                    containers[i] = pos
+                    nb_tree_matches += rank < len(replies)
+                    break
+        for i in byDate[start:end]:
+            bisect.insort(newer, (lengths[i], i))
+        end = start
+    if counts is not None:
+        counts.update(conversations=1, messages=n, pairs=n*(n-1)//2, candidates=nb_candidates, text_compares=nb_texts,
+            tree_compares=nb_tree, tree_matches=nb_tree_matches, fallback_compares=nb_texts - nb_tree)
+    rows = []
+    for mess, pos in zip(messages, containers):
+        if pos is not None:
+            mess2 = messages[pos]
+            rows.append((mess.folderName, mess.conversationID, mess.ID, mess.date, mess.subject, mess.topic, mess.senderName,
+                mess.toDelete, mess.mess_size, mess2.ID, mess2.folderName, mess2.date, "contained", None))
+    return rows
+
+BODY_BANNERS = ["C1 - Internal use", "C2 - Confidential", "C3 - Highly Confidential"] #Confidentiality statuses sometimes inserted in replies
+
+def body_rules(banners=BODY_BANNERS):
+    """Default rule table of BodyNormalizer: (name, pattern, replacement, triggers) of texts that are often modified when a message is quoted in a reply"""
+    rules = [("mailto", r" <mailto:[\w.\-]+@[\w.\-]+.\w+> ?", "", [" <mailto:"]), #Sometimes the name is inserted in the mail of a reply. We remove it
+        ("url", r"(?P<url_text>https?://[\w.\-+/]+) <(?P=url_text)> ?", r"\g<url_text>", [" <http"])] #Sometimes the URL is repeated after its text. We remove it
+    if banners:
+        rules.append(("banner", "|".join(re.escape(banner) for banner in banners), "", list(banners))) #Sometimes a Confidentiality status is inserted. We remove it
+    return rules
+
+class BodyNormalizer:
+    """Applies a rule table to a body, after removing line breaks and the spaces around them.
+    Rules are (name, pattern, replacement) or (name, pattern, replacement, triggers), triggers being literal texts without which the rule
+    can't match: a rule only runs on the bodies that contain one of its triggers, so most bodies are only scanned by `in` tests.
+    Rules run one after the other, in their order: a pattern that starts with a literal is searched much faster alone than in an alternation"""
+    def __init__(self, rules, fold_lines=True):
+        self.fold_lines = fold_lines
+        self.rules = [(re.compile(pattern), replacement, triggers[0] if triggers else None) for name, pattern, replacement, *triggers in rules]
+
+    def __call__(self, body):
+        if self.fold_lines:
+            body = ''.join([line.strip() for line in body.splitlines()]) #Line breaks followed by spaces are sometimes changed in replies
+        for pattern, replacement, triggers in self.rules:
+            if triggers is None or any(trigger in body for trigger in triggers):
+                body = pattern.sub(replacement, body)
+        return body
+
+BODY_NORMALIZER = BodyNormalizer(body_rules())
+
+def set_body_rules(rules, fold_lines=True):
+    """Replaces the rules used by normalize_body. Messages cached by outlook_cache were normalized with the previous rules"""
+    global BODY_NORMALIZER
+    BODY_NORMALIZER = BodyNormalizer(rules, fold_lines)
+
+def normalize_body(body):
+    """Removes from a message body what is often modified when a message is quoted in a reply"""
+    return BODY_NORMALIZER(body)
+
+def compare_conversations(conversations, deleted_folder):
+    """Compares a chunk of conversations [(position, messages)], and returns ([(position, rows)], counts). Runs in a worker process"""
+    counts = collections.Counter()
+    return [(position, compare_conversation(messages, deleted_folder, counts)) for position, messages in conversations], counts
+
+def split_conversations(conversations, nb_chunks):
+    """Splits [(position, messages)] in at most nb_chunks lists with a similar number of message pairs to compare"""
+    chunks = [[] for i in range(nb_chunks)]
+    costs = [(0, i) for i in range(nb_chunks)] #heap of (cost, chunk number)
+    for position, messages in sorted(conversations, key=lambda conversation: -len(conversation[1])): #Biggest first, to the lightest chunk
+        cost, i = heapq.heappop(costs)
+        chunks[i].append((position, messages))
+        heapq.heappush(costs, (cost + len(messages)**2, i))
+    return [chunk for chunk in chunks if chunk]
+
+def compare_parallel(subLists, store, deleted_folder, workers, progress, interrupted, counts=None, done=None):
+    """Compares the conversations subLists (arrays of rows of store) in a pool of worker processes, and yields the rows of each chunk
+    of conversations as soon as it is compared (so not in the order of subLists). Compared conversations are released from subLists.
+    Chunks are materialized as Message lists only when submitted, a few per worker at a time.
+    counts receives the comparison counts of the workers (see compare_conversation). done(position, rows) is called for each conversation compared"""
+    conversations = [(position, subList) for position, subList in enumerate(subLists) if subList is not None and len(subList) > 1]
+    count_topic_read = len(subLists) - len(conversations) #Conversations of a single message have nothing to compare
+    progress(count_topic_read)
+    chunks = split_conversations(conversations, workers * 4) #Several chunks per worker, for a smoother progress
+    del conversations
+    pool = concurrent.futures.ProcessPoolExecutor(workers)
+    try:
+        pending = {}
+        while chunks or pending:
+            while chunks and len(pending) < workers * 2:
+                chunk = chunks.pop()
+                pending[pool.submit(compare_conversations, [(position, store.messages(rows)) for position, rows in chunk], deleted_folder)] = len(chunk)
+            finished, not_finished = concurrent.futures.wait(pending, timeout=0.2, return_when=concurrent.futures.FIRST_COMPLETED)
+            if interrupted():
+                raise KeyboardInterrupt("User clicked on Cancel")
+            for future in finished:
+                chunkResults, chunkCounts = future.result()
+                count_topic_read += pending.pop(future)
+                if counts is not None:
+                    counts.update(chunkCounts)
+                for position, rows in sorted(chunkResults, key=lambda result: result[0]):
+                    subLists[position] = None
+                    if done is not None:
+                        done(position, rows)
+                    yield from rows
+                progress(count_topic_read)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+class MessageStore:
+    """Compact storage of the messages of a search, addressed by row number. Conversations are arrays of rows.
+    - repeated strings (folder, conversation, subject, sender...) are interned, and attachments are interned tuples of names
+    - dates (in microseconds), sizes and flags are stored in arrays
+    - bodies are encoded in UTF-8, one after the other in a single buffer, addressed by offset
+    Message records are built again only when needed, e.g. for the conversation being compared"""
+    def __init__(self):
+        self.strings = {} #Interned strings and attachment tuples
+        self.folderName, self.conversationID, self.ID, self.subject, self.topic = [], [], [], [], []
+        self.senderName, self.senderMail, self.atts, self.conversationIndex = [], [], [], []
+        self.dates = array.array("q") #Microseconds since EPOCH
+        self.sizes = array.array("q")
+        self.flags = bytearray() #1: isUnread, 2: toDelete
+        self.bodies = bytearray() #Bodies encoded in UTF-8
+        self.body_offsets = array.array("q") #-1 when the body was not read yet
+        self.body_lengths = array.array("q")
+
+    def __len__(self):
+        return len(self.ID)
+
+    def intern(self, value):
+        return self.strings.setdefault(value, value)
+
+    def append(self, mess):
+        """Stores a Message, and returns its row"""
+        intern = self.intern
+        row = len(self.ID)
+        self.folderName.append(intern(mess.folderName))
+        self.conversationID.append(intern(mess.conversationID))
+        self.ID.append(mess.ID)
+        self.subject.append(intern(mess.subject))
+        self.topic.append(intern(mess.topic))
+        self.senderName.append(intern(mess.senderName))
+        self.senderMail.append(intern(mess.senderMail))
+        self.conversationIndex.append(mess.conversationIndex)
+        self.dates.append((mess.date - EPOCH) // MICROSECOND)
+        self.sizes.append(mess.mess_size or 0)
+        self.flags.append(bool(mess.isUnread) | bool(mess.toDelete) << 1)
+        self.atts.append(None)
+        self.body_offsets.append(-1)
+        self.body_lengths.append(0)
+        if mess.body is not None:
+            self.set_content(row, mess.body, mess.atts)
+        return row
+
+    def set_content(self, row, body, atts):
+        encoded = body.encode("utf-8", "surrogatepass")
+        self.body_offsets[row], self.body_lengths[row] = len(self.bodies), len(encoded)
+        self.bodies += encoded
+        self.atts[row] = self.intern(tuple(self.intern(name) for name in atts))
+
+    def has_body(self, row):
+        return self.body_offsets[row] >= 0
+
+    def body(self, row):
+        offset = self.body_offsets[row]
+        if offset < 0:
+            return None
+        return self.bodies[offset:offset+self.body_lengths[row]].decode("utf-8", "surrogatepass")
+
+    def date(self, row):
+        return EPOCH + datetime.timedelta(microseconds=self.dates[row])
+
+    def message(self, row):
+        flags = self.flags[row]
+        return Message(self.folderName[row], self.conversationID[row], self.ID[row], self.date(row), self.subject[row], self.topic[row],
+            bool(flags & 1), self.senderName[row], self.senderMail[row], bool(flags & 2), self.body(row), self.atts[row], self.sizes[row],
+            self.conversationIndex[row])
+
+    def messages(self, rows):
+        return [self.message(row) for row in rows]
+
+    def fetch_contents(self, rows, source):
+        """Reads the bodies and attachments of rows from source. Yields each row once read. A message that source could not read
+        (moved or deleted since it was listed) keeps no body"""
+        for row, mess in zip(rows, source.fetch_contents(self.message(row) for row in rows)):
+            if mess.body is not None:
+                self.set_content(row, mess.body, mess.atts)
+            yield row
+
+def read_folders(source, newStep, progress, interrupted, stats=None, checkpoint=None):
+    """Read stage: yields the messages of each folder of source, one list per folder.
+    Folders already read by the search that checkpoint (outlook_checkpoint.ScanCheckpoint) resumes are not read again"""
+    count_read_mails = 0
+    if stats is not None:
+        stats.new_stage("list folders")
+    folders = source.list_folders()
+    keys = [source.folder_key(folder) for folder in folders] if checkpoint is not None else [None] * len(folders)
+    if checkpoint is not None:
+        checkpoint.fingerprint = keys
+    if stats is not None:
+        stats.new_stage("read")
+        stats.counters["messages"] = source.total_count
+    newStep(f"Step 1/3 - Read all {source.total_count} messages", 0, source.total_count)
+    for folder, key in zip(folders, keys): #loop on folders to read all messages
+        if checkpoint is not None and key in checkpoint.folders: #Read by the interrupted search
+            folderMessages = checkpoint.folders.pop(key) #Still in the checkpoint file, if the search is interrupted again
+            source.folder_resumed([mess.ID for mess in folderMessages])
+            count_read_mails += len(folderMessages)
+            progress(count_read_mails)
+            if stats is not None:
+                stats.counters["resumed_folders"] += 1
+            yield folderMessages
+            continue
+        folder_start = time.perf_counter()
+        folderMessages = []
+        for mess in source.read_folder(folder):
+            if interrupted():
+                raise KeyboardInterrupt("User clicked on Cancel")
+            folderMessages.append(mess)
+            count_read_mails += 1
+            progress(count_read_mails)
+        if stats is not None:
+            stats.folder(folder[0], len(folderMessages), time.perf_counter() - folder_start)
+        if checkpoint is not None:
+            checkpoint.folder_done(key, folderMessages)
+        yield folderMessages
+
+def receipt_row(mess):
+    """Row (RESULT_COLS) of an undelivered or recalled receipt, that has no newer message"""
+    return (mess.folderName, mess.conversationID, mess.ID, mess.date, mess.subject, mess.topic, mess.senderMail, mess.toDelete, mess.mess_size,
+        None, None, None, "receipt", None)
+
+def group_conversations(folderLists, receipts, store):
+    """Group stage: appends the rows of undelivered or recalled receipts to receipts, stores the other messages in store (MessageStore),
+    and returns their rows grouped by conversation. Conversations keep their order of appearance, and their messages are sorted by date within each folder"""
+    conversations = {}
+    for folderMessages in folderLists:
+        for mess in folderMessages:
+            if mess.toDelete:
+                receipts.append(receipt_row(mess))
+        folderMessages = sorted((mess for mess in folderMessages if not mess.toDelete), key=lambda mess: mess.date)
+        for mess in folderMessages:
+            conversations.setdefault(mess.conversationID, array.array("l")).append(store.append(mess))
+    return list(conversations.values())
+
+def drop_unread(subLists, store, rows, stats=None):
+    """Removes from their conversation the rows whose content could not be fetched. Returns their set"""
+    unread = {row for row in rows if not store.has_body(row)}
+    if unread:
+        logging.warning(f"{len(unread)} messages could not be read, they were moved or deleted during the search")
+        for position, subList in enumerate(subLists):
+            if subList is not None and any(row in unread for row in subList):
+                subLists[position] = array.array("l", (row for row in subList if row not in unread))
+        if stats is not None:
+            stats.counters["unreadable"] += len(unread)
+    return unread
+
+def find_copies(subLists, store, source, newStep, progress, interrupted, stats=None):
+    """Copy stage: returns the rows (RESULT_COLS) of exact copies of a message (same sender, CreationTime, subject, body and attachments),
+    in any folder or conversation, and removes them from their conversation. One linear pass on hash indexes, without pairwise comparison.
+    Only messages that share sender, date and subject get their content read. The kept copy is the first one outside
+    the deleted folder, so that, as in compare_conversation, a message is never deleted because of a copy in the deleted folder"""
+    if stats is not None:
+        stats.new_stage("copies")
+    index = {} #(sender, date, subject): [(conversation position, row)]
+    for position, subList in enumerate(subLists):
+        for row in subList:
+            index.setdefault((store.senderMail[row], store.dates[row], store.subject[row]), []).append((position, row))
+    candidates = [group for group in index.values() if len(group) > 1]
+    del index
+    toFetch = [row for group in candidates for position, row in group if not store.has_body(row)]
+    if toFetch:
+        newStep(f"Step 2/3 - Read bodies and attachments of {len(toFetch)} possible copies", 0, len(toFetch))
+    for count, row in enumerate(store.fetch_contents(toFetch, source), 1):
+        if interrupted():
+            raise KeyboardInterrupt("User clicked on Cancel")
+        progress(count)
+    source.contents_read += len(toFetch)
+    unread = drop_unread(subLists, store, toFetch, stats)
+    rows, removed = [], set()
+    for group in candidates:
+        copies = {} #(body, attachments): [(conversation position, row)]
+        for position, row in group:
+            if row not in unread:
+                copies.setdefault((store.body(row), store.atts[row]), []).append((position, row))
+        for positions in copies.values():
+            if len(positions) < 2:
+                continue
+            messages = [store.message(row) for position, row in positions]
+            keep = next((mess for mess in messages if mess.folderName != source.deleted_folder), messages[0])
+            for (position, row), mess in zip(positions, messages):
+                if mess is not keep:
+                    rows.append((mess.folderName, mess.conversationID, mess.ID, mess.date, mess.subject, mess.topic, mess.senderMail,
+                        mess.toDelete, mess.mess_size, keep.ID, keep.folderName, keep.date, "copy", None))
+                    removed.add(row)
+    for position in {position for group in candidates for position, row in group}:
+        subLists[position] = array.array("l", (row for row in subLists[position] if row not in removed))
+    logging.info(f"{len(rows)} exact copies found, {len(toFetch)} bodies read to find them")
+    if stats is not None:
+        stats.counters.update(copy_candidates=sum(map(len, candidates)), copies=len(rows))
+    return rows
+
+def content_needed(store, rows, deleted_folder):
+    """Returns, for each row of a conversation, if its message can be compared to another one, as the older or as the newer message.
+    Same rules as compare_conversation: the newer message must be strictly more recent, and not in deleted_folder unless the older one is"""
+    dates = [store.dates[row] for row in rows]
+    inDeleted = [store.folderName[row] == deleted_folder for row in rows]
+    otherDates = [date for date, deleted in zip(dates, inDeleted) if not deleted]
+    deletedDates = [date for date, deleted in zip(dates, inDeleted) if deleted]
+    newest, oldest = max(dates), min(dates)
+    newestOther = max(otherDates) if otherDates else None
+    oldestDeleted = min(deletedDates) if deletedDates else None
+    needed = []
+    for date, deleted in zip(dates, inDeleted):
+        if deleted: #Older message of a newer one anywhere, or newer message of an older deleted one
+            needed.append(newest > date or oldestDeleted < date)
+        else: #Older message of a newer one outside deleted_folder, or newer message of any older one
+            needed.append(newestOther > date or oldest < date)
+    return needed
+
+def fetch_contents(subLists, store, source, newStep, progress, interrupted, stats=None):
+    """Fetch stage: reads the bodies and attachments that the source did not read with the other properties,
+    only for messages that can be compared. Messages that can't be compared are removed from their conversation"""
+    if stats is not None:
+        stats.new_stage("fetch")
+    toFetch = [] #Rows
+    source.contents_avoided = 0
+    for position, subList in enumerate(subLists):
+        if len(subList) < 2: #A message alone in its conversation can't be a duplicate
+            source.contents_avoided += sum(1 for row in subList if not store.has_body(row)) #Empty if its copies were removed
+            continue
+        needed = content_needed(store, subList, source.deleted_folder)
+        if not all(needed):
+            source.contents_avoided += sum(1 for row, need in zip(subList, needed) if not store.has_body(row) and not need)
+            subLists[position] = subList = array.array("l", (row for row, need in zip(subList, needed) if need))
+        toFetch += [row for row in subList if not store.has_body(row)]
+    source.contents_read += len(toFetch)
+    if toFetch:
+        newStep(f"Step 2/3 - Read bodies and attachments of {len(toFetch)} messages", 0, len(toFetch))
+    for count, row in enumerate(store.fetch_contents(toFetch, source), 1):
+        if interrupted():
+            raise KeyboardInterrupt("User clicked on Cancel")
+        progress(count)
+    drop_unread(subLists, store, toFetch, stats)
+    logging.info(f"Bodies and attachments read for {source.contents_read} messages, avoided for {source.contents_avoided}")
+    if stats is not None:
+        stats.counters.update(contents_read=source.contents_read, contents_avoided=source.contents_avoided)
+    return subLists
+
+def compare_stage(subLists, store, deleted_folder, progress, interrupted, workers=1, stats=None, done=None):
+    """Compare stage: yields the rows of the messages contained in a newer message, conversation by conversation
+    (or chunk by chunk, in any order, with workers > 1). Conversations are released from subLists once compared,
+    and conversations already set to None are skipped. done(position, rows) is called for each conversation compared"""
+    counts = None
+    if stats is not None:
+        stats.new_stage("compare")
+        counts = stats.compare
+    if workers > 1 and sum(len(subList) for subList in subLists if subList is not None and len(subList) > 1) >= PARALLEL_MIN_MESSAGES:
+        try:
+            yield from compare_parallel(subLists, store, deleted_folder, workers, progress, interrupted, counts, done)
+            return
+        except (OSError, concurrent.futures.BrokenExecutor) as e: #Processes can't be started, or died: serial fallback
+            logging.warning(f"Parallel comparison failed ({e}). Comparing the other conversations in a single process")
+    for position in range(len(subLists)): #Loop on all conversation
+        if interrupted():
+            raise KeyboardInterrupt("User clicked on Cancel")
+        subList, subLists[position] = subLists[position], None
+        if subList is not None and len(subList) > 1: #Not already compared, nor alone in its conversation
+            rows = compare_conversation(store.messages(subList), deleted_folder, counts)
+            if done is not None:
+                done(position, rows)
+            yield from rows
+        progress(position + 1) #Update progress bar
+
+def search_duplicates(source, newStep, progress, interrupted, workers=1, stats=None, copies=True, checkpoint=None, near_threshold=None):
+    """Reads all messages of a mail source (see outlook_sources), and returns the rows (RESULT_COLS) of the messages
+    that can be deleted: undelivered or recalled receipts first, then exact copies (if copies is True), then messages contained in a newer one.
+    newStep(text, minimum, maximum) and progress(n) report progress. interrupted() is polled to cancel the search.
+    With workers > 1, conversations are compared in that many processes. stats is an optional outlook_stats.RunStats.
+    checkpoint is an optional outlook_checkpoint.ScanCheckpoint, to resume an interrupted search and to save this one as it goes.
+    With a near_threshold, near duplicates are searched last (see outlook_similarity, that requires NumPy), and all bodies are read"""
+    return list(iter_duplicates(source, newStep, progress, interrupted, workers, stats, copies, checkpoint, near_threshold))
+
+def iter_duplicates(source, newStep, progress, interrupted, workers=1, stats=None, copies=True, checkpoint=None, near_threshold=None):
+    """Generator version of search_duplicates: receipts and copies are yielded once all messages are read, then the contained messages
+    as conversations are compared, then the near duplicates"""
+    if stats is None:
+        stats = outlook_stats.RunStats()
+    source.stats = stats #For the calls of the source
+    source.interrupted = interrupted #For the sources that wait, e.g. outlook_process.ProcessSource
+    if near_threshold is not None:
+        import outlook_similarity #Only with NumPy
+        source.lazy = False #Near duplicates are searched in all messages, not only the ones fetch_contents keeps
+    rows = [] #Receipts and copies
+    completed = False
+    try:
+        if checkpoint is not None:
+            checkpoint.open(source, copies=copies, near=near_threshold is not None)
+        if checkpoint is not None and checkpoint.state is not None: #Messages may have been deleted or received since
+            stats.new_stage("list folders")
+            if [source.folder_key(folder) for folder in source.list_folders()] != checkpoint.fingerprint:
+                logging.info("The mailbox changed since the interrupted search: it is searched again")
+                checkpoint.discard()
+        if checkpoint is not None and checkpoint.state is not None: #All folders were read by the interrupted search
+            rows, store, subLists, source.total_count = checkpoint.state
+            checkpoint.state = None
+            stats.counters["messages"] = source.total_count
+        else:
+            store = MessageStore()
+            subLists = group_conversations(read_folders(source, newStep, progress, interrupted, stats, checkpoint), rows, store)
+            if copies:
+                rows += find_copies(subLists, store, source, newStep, progress, interrupted, stats)
+            subLists = fetch_contents(subLists, store, source, newStep, progress, interrupted, stats)
+            if checkpoint is not None:
+                checkpoint.save_state(rows, store, subLists, source.total_count)
+            completed = True
+    except BaseException:
+        if checkpoint is not None:
+            checkpoint.close(False)
+        raise
+    finally:
+        source.close(completed)
+    stats.counters.update(receipts=sum(1 for row in rows if row[-2] == "receipt"), conversations=len(subLists))
+    completed = False
+    reported = set() #IDs of the messages reported, not to report them again as near duplicates
+    try:
+        yield from rows
+        newStep("Step 3/3 - Compare all messages", 0, len(subLists))
+        count = len(rows)
+        reported.update(row[2] for row in rows)
+        if checkpoint is not None and checkpoint.compared: #Conversations compared by the interrupted search
+            stats.counters["resumed_conversations"] = len(checkpoint.compared)
+            for position, compared in checkpoint.compared.items():
+                subLists[position] = None
+                count += len(compared)
+                reported.update(row[2] for row in compared)
+                yield from compared
+        done = checkpoint.conversation_done if checkpoint is not None else None
+        for row in compare_stage(subLists, store, source.deleted_folder, progress, interrupted, workers, stats, done):
+            count += 1
+            reported.add(row[2])
+            yield row
+        if near_threshold is not None:
+            similar = outlook_similarity.find_similar(store, reported, source.deleted_folder, near_threshold, newStep, progress, interrupted, stats)
+            count += len(similar)
+            yield from similar
+        completed = True
+    finally:
+        if checkpoint is not None:
+            checkpoint.close(completed)
+    stats.end_stage()
+    stats.counters["duplicates"] = count
+
+def iter_mailboxes(mailboxes, open_scan, newStep, progress, interrupted, threads=2, workers=1, stats=None, copies=True, near_threshold=None, status=None):
+    """Searches duplicates in several mailboxes at once: each mailbox is read by its own thread, with at most threads running.
+    open_scan(mailbox) is a context manager called in the thread of the mailbox, that gives its (source, checkpoint), e.g. with its own
+    COM apartment and namespace. Yields the rows (MAILBOX_COLS) of all mailboxes as they come: the row of iter_duplicates, after the mailbox.
+    The compare workers are split between the threads: each mailbox compares its conversations in its own pool of workers // threads
+    processes. The stats of each mailbox are merged in stats, and the first error is raised at the end.
+    A single mailbox reports its steps and its number of messages. Several mailboxes report one step, with newStep(text, 0, 1000, rate=False)
+    (see outlook_stats.ProgressReporter.new_step), and progress in per mille of all the searches. The step of each mailbox is shown by status(text)"""
+    if stats is None:
+        stats = outlook_stats.RunStats()
+    threads = max(1, min(threads, len(mailboxes)))
+    mailbox_workers = max(1, workers // threads)
+    events = queue.Queue() #(kind, mailbox, values) sent by the threads
+    stopped = False #Set if the caller stops iterating
+
+    def scan(mailbox): #Runs in the thread of mailbox
+        mailboxStats, error = outlook_stats.RunStats(mailbox=mailbox), None
+        try:
+            with open_scan(mailbox) as (source, checkpoint):
+                for row in iter_duplicates(source, lambda text, minimum=0, maximum=100: events.put(("step", mailbox, (text, minimum, maximum))),
+                        lambda n: events.put(("progress", mailbox, n)), lambda: stopped or interrupted(), mailbox_workers, mailboxStats,
+                        copies, checkpoint, near_threshold):
+                    events.put(("row", mailbox, row))
+        except BaseException as e:
+            error = e
+        events.put(("done", mailbox, (mailboxStats, error)))
+
+    steps = {mailbox: (0, 1, "Waiting", 0, 100) for mailbox in mailboxes} #mailbox: (step number, number of steps, text, minimum, maximum)
+    fractions = dict.fromkeys(mailboxes, 0.0) #Part of the search done, per mailbox
+    errors, remaining = [], len(mailboxes)
+    pool = concurrent.futures.ThreadPoolExecutor(threads)
+    try:
+        for mailbox in mailboxes:
+            pool.submit(scan, mailbox)
+        single = len(mailboxes) == 1
+        if not single:
+            newStep(f"Scanning {len(mailboxes)} mailboxes, {threads} at a time", 0, 1000, rate=False)
+        while remaining:
+            kind, mailbox, values = events.get()
+            if kind == "row":
+                yield (mailbox,) + values
+                continue
+            if single and kind == "step": #Steps and progress of the search itself
+                newStep(*values)
+            elif single and kind == "progress":
+                progress(values)
+            elif kind == "step":
+                text, minimum, maximum = values
+                match = STEP.search(text)
+                number, count = (int(match[1]), int(match[2])) if match else steps[mailbox][:2]
+                steps[mailbox] = (number, count, text, minimum, maximum)
+                fractions[mailbox] = max(number - 1, 0) / count
+                if status is not None:
+                    status(f"{len(mailboxes) - remaining}/{len(mailboxes)} mailboxes done - {mailbox}: {text}")
+            elif kind == "progress":
+                number, count, text, minimum, maximum = steps[mailbox]
+                fractions[mailbox] = (max(number - 1, 0) + min(max((values - minimum) / max(maximum - minimum, 1), 0), 1)) / count
+            elif kind == "done":
+                remaining -= 1
+                mailboxStats, error = values
+                fractions[mailbox] = 1.0
+                stats.merge(mailboxStats, mailbox)
+                if status is not None and not single:
+                    status(f"{len(mailboxes) - remaining}/{len(mailboxes)} mailboxes done - {mailbox}: {'stopped' if error else 'done'}")
+                if isinstance(error, KeyboardInterrupt):
+                    errors.append(error)
+                elif error is not None:
+                    logging.error(f"Search of {mailbox} failed: {error!r}")
+                    errors.append(error)
+            if not single:
+                progress(round(1000 * sum(fractions.values()) / len(mailboxes)))
+    finally:
+        stopped = True
+        pool.shutdown(wait=True)
+    stats.counters["mailboxes"] = len(mailboxes)
+    if errors:
+        raise errors[0]
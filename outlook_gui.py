@@ -0,0 +1,692 @@
+"""User interface of Outlook - Cleaning.py, launched by main() with the settings of the script.
+Kept out of the script, so that the processes it spawns (reader process, comparison workers), that run the script again
+without its main part, import neither Qt, pandas nor win32com"""
+import os, sys, logging, datetime, traceback, time, contextlib, functools
+import pandas as pd
+import win32com.client, pythoncom #pip install pywin32
+from PySide6 import QtCore, QtWidgets, QtGui
+import outlook_engine, outlook_cache, outlook_checkpoint, outlook_sources, outlook_stats, outlook_session, outlook_process
+
+class WorkerSignals(QtCore.QObject): #Generic class defining signals available for a Worker in a thread
+    finished = QtCore.Signal()
+    error = QtCore.Signal(tuple)
+    newStep = QtCore.Signal(str, int, int) #specific signal
+    result = QtCore.Signal(object)
+    progress = QtCore.Signal(int) #will be implemented via a callback function
+    status = QtCore.Signal(str) #Text of the step, with throughput and ETA
+    rows = QtCore.Signal(list) #Batch of results published before the end of the work
+
+class Worker(QtCore.QRunnable): #Generic class to build a worker. Will be used for all backend operations on mails
+    def __init__(self, fn, *args, **kwargs): #Create a worker to launch fn in a thread
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals() #Define signals
+        self.kwargs['progress_callback'] = outlook_stats.ProgressReporter(self.signals.newStep.emit, self.signals.progress.emit,
+            self.signals.status.emit) #Add the callback to track progress to our kwargs. It limits signals to about 10 per second
+
+    @QtCore.Slot()
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs) #Call fn, with kwargs (including the callback for progress)
+        except:
+            traceback.print_exc()
+            exctype, value = sys.exc_info()[:2]
+            self.signals.error.emit((exctype, value, traceback.format_exc()))
+        else:
+            self.signals.result.emit(result)  #Return the result of the processing
+        finally:
+            self.signals.finished.emit()
+
+class ui_MainWindow(QtWidgets.QMainWindow): #Bare user interface without any logic attached to widgets
+    def __init__(self, VERSION, HELP_TEXT):
+        super().__init__()
+        self.setWindowTitle(f"Outlook Duplicates Cleaner - version {VERSION}")
+        menu = self.menuBar()
+        self.help_action = QtGui.QAction("&Help", self)
+        menu.addAction(self.help_action)
+        self.stats_action = QtGui.QAction("&Stats", self)
+        menu.addAction(self.stats_action)
+        self.open_action = QtGui.QAction("&Open results", self)
+        menu.addAction(self.open_action)
+
+        self.helpText = QtWidgets.QPlainTextEdit(HELP_TEXT)
+        self.helpText.setWindowTitle("Help")
+        self.helpText.setReadOnly(True)
+        self.helpText.setMinimumSize(650, 350)
+
+        self.statsText = QtWidgets.QPlainTextEdit()
+        self.statsText.setWindowTitle("Stats of the last search")
+        self.statsText.setReadOnly(True)
+        self.statsText.setMinimumSize(650, 450)
+
+        central_widget = QtWidgets.QWidget()
+        central_widget.setMinimumSize(700, 400)
+        central_layout = QtWidgets.QVBoxLayout()
+        central_widget.setLayout(central_layout)
+        self.setCentralWidget(central_widget)
+
+        self.param_group = QtWidgets.QGroupBox("Select your mailbox:")
+        param_layout = QtWidgets.QVBoxLayout()
+
+        self.mailbox_choice = QtWidgets.QComboBox()
+        param_layout.addWidget(self.mailbox_choice)
+        self.multi_checkbox = QtWidgets.QCheckBox("Search several mailboxes at once (tick them below)")
+        param_layout.addWidget(self.multi_checkbox)
+        self.mailbox_list = QtWidgets.QListWidget() #Mailboxes with a checkbox, for a search of several mailboxes
+        self.mailbox_list.setMaximumHeight(100)
+        self.mailbox_list.hide()
+        param_layout.addWidget(self.mailbox_list)
+        self.rebuild_cache_checkbox = QtWidgets.QCheckBox("Rebuild scan cache (read again all messages from Outlook)")
+        param_layout.addWidget(self.rebuild_cache_checkbox)
+        self.copies_checkbox = QtWidgets.QCheckBox("Also find exact copies of messages in other folders")
+        param_layout.addWidget(self.copies_checkbox)
+        self.near_checkbox = QtWidgets.QCheckBox("Also find similar messages (quoted with other line breaks or quote marks). Slower: all bodies are read")
+        param_layout.addWidget(self.near_checkbox)
+        self.resume_checkbox = QtWidgets.QCheckBox("Resume the last search if it was interrupted (folders and conversations already done are kept)")
+        param_layout.addWidget(self.resume_checkbox)
+        self.param_group.setLayout(param_layout)
+        central_layout.addWidget(self.param_group, stretch=0)
+        self.param_group.hide()
+
+        self.find_button = QtWidgets.QPushButton("Search Duplicates")
+        self.find_button.setFixedWidth(120)
+        #self.find_button.setEnabled(False) #At startup, it is disabled
+        central_layout.addWidget(self.find_button, stretch=0)
+
+        self.progress_group = QtWidgets.QGroupBox("Progress:")
+        progress_layout = QtWidgets.QHBoxLayout()
+        self.progress_label = QtWidgets.QLabel("Progress of step 1/3:")
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.cancel_button = QtWidgets.QPushButton("Cancel")
+        progress_layout.addWidget(self.progress_label)
+        progress_layout.addWidget(self.progress_bar)
+        progress_layout.addWidget(self.cancel_button)
+        self.progress_group.setLayout(progress_layout)
+        central_layout.addWidget(self.progress_group, stretch=0)
+
+        self.result_group = QtWidgets.QGroupBox("Duplicates that can be deleted:")
+        result_layout = QtWidgets.QVBoxLayout()
+        self.selectAll_checkbox = QtWidgets.QCheckBox("Select All")
+        self.selectAll_checkbox.setChecked(True)
+        self.result_table = QtWidgets.QTableView()
+        self.result_label = QtWidgets.QLabel("")
+        result_buttons_layout = QtWidgets.QHBoxLayout()
+        result_layout.addWidget(self.selectAll_checkbox, stretch = 0)
+        result_layout.addWidget(self.result_table, stretch = 1) #If we stretch the main window, result_table will stretch
+        result_layout.addWidget(self.result_label, stretch = 0)
+        result_layout.addLayout(result_buttons_layout, stretch = 0)
+
+        self.export_button = QtWidgets.QPushButton("Copy to Clipboard")
+        self.export_button.setFixedWidth(120)
+        self.save_button = QtWidgets.QPushButton("Save results...")
+        self.save_button.setFixedWidth(120)
+        self.delete_button = QtWidgets.QPushButton("Delete selected mails")
+        self.delete_button.setFixedWidth(120)
+        result_buttons_layout.addWidget(self.export_button, stretch = 0)
+        result_buttons_layout.addWidget(self.save_button, stretch = 0)
+        result_buttons_layout.addWidget(self.delete_button, stretch = 0)
+
+        self.result_group.setLayout(result_layout)
+        central_layout.addWidget(self.result_group, stretch=1)
+
+        self.result_group.hide() #will be displayed once we have results
+        central_layout.addStretch() #allows window to stretch nicely while there are no results
+
+class MainWindow(ui_MainWindow): #Adds logic to the interface widgets
+    def __init__(self, VERSION, HELP_TEXT, FOLDER_SIZE_LIMIT, EXCLUDED_FOLDERS, INCLUDE_SUBFOLDERS, SCAN_CACHE, CACHE_MAX_ENTRIES, COMPARE_WORKERS,
+            READER_PROCESS, MAILBOX_THREADS, FIND_COPIES, SCAN_CHECKPOINT, CHECKPOINT_INTERVAL, RESULTS_INTERVAL, DELETE_RETRIES, RUN_REPORT,
+            NEAR_DUPLICATES, NEAR_THRESHOLD):
+        logging.info(f"Running Outlook Cleaner version {VERSION}")
+        super().__init__(VERSION, HELP_TEXT)
+        self.interrupt = False #Flag that will be triggered if user chooses to cancels a background job
+        self.threadpool = QtCore.QThreadPool() #Pool for workers threads that will perform background work on emails
+
+        self.help_action.triggered.connect(lambda x: self.helpText.show())
+        self.stats_action.triggered.connect(self.show_stats_f)
+        self.open_action.triggered.connect(self.open_session_f)
+        self.mailbox_choice.currentIndexChanged.connect(self.mailbox_chosen_f)
+        self.multi_checkbox.toggled.connect(self.multi_toggled_f)
+        self.find_button.clicked.connect(self.launch_search_f)
+        self.cancel_button.clicked.connect(lambda x: setattr(self, "interrupt", True)) #Signal to interrupt progress
+        self.selectAll_checkbox.stateChanged.connect(self.selectAll_changed_f)
+        self.export_button.clicked.connect(self.export_result_f)
+        self.save_button.clicked.connect(self.save_session_f)
+        self.delete_button.clicked.connect(self.delete_selected_f)
+
+        self.FOLDER_SIZE_LIMIT = FOLDER_SIZE_LIMIT
+        self.EXCLUDED_FOLDERS = EXCLUDED_FOLDERS
+        self.INCLUDE_SUBFOLDERS = INCLUDE_SUBFOLDERS
+        self.SCAN_CACHE = SCAN_CACHE
+        self.CACHE_MAX_ENTRIES = CACHE_MAX_ENTRIES
+        self.COMPARE_WORKERS = COMPARE_WORKERS
+        self.READER_PROCESS = READER_PROCESS
+        self.MAILBOX_THREADS = MAILBOX_THREADS
+        self.RESULTS_INTERVAL = RESULTS_INTERVAL
+        self.DELETE_RETRIES = DELETE_RETRIES
+        self.RUN_REPORT = RUN_REPORT
+        self.VERSION = VERSION
+        self.copies_checkbox.setChecked(FIND_COPIES)
+        self.near_checkbox.setChecked(NEAR_DUPLICATES)
+        self.NEAR_THRESHOLD = NEAR_THRESHOLD
+        self.SCAN_CHECKPOINT = SCAN_CHECKPOINT
+        self.CHECKPOINT_INTERVAL = CHECKPOINT_INTERVAL
+        self.resume_checkbox.setChecked(True)
+        self.resume_checkbox.setVisible(bool(SCAN_CHECKPOINT))
+        self.sources = {} #mailbox: OutlookSource of the last search
+        self.StoreIDs = {} #mailbox: StoreID, to delete the messages found in each mailbox
+        self.del_model = None
+        self.stats = None #outlook_stats.RunStats of the last search
+        self.searching = False #True while a search runs. Its first results can already be deleted
+
+        self.initiate_new_step("Retrieving mailboxes")
+        worker_mailbox = Worker(self.list_mailboxes_b) #Create a thread to get the list of mailboxes
+        worker_mailbox.signals.result.connect(self.list_mailboxes_b_result)
+        worker_mailbox.signals.error.connect(self.list_mailboxes_b_error)
+        self.threadpool.start(worker_mailbox) #Launch thread
+
+    def mailbox_chosen_f(self): #Triggered by mailbox_choice
+        self.result_group.hide() #Hide results if we choose a different mailbox
+        self.CurrentAccountName = self.mailbox_choice.currentText()
+
+    @QtCore.Slot()
+    def multi_toggled_f(self, checked): #Triggered by multi_checkbox: the mailboxes are ticked in mailbox_list instead of chosen in mailbox_choice
+        self.mailbox_choice.setVisible(not checked)
+        self.mailbox_list.setVisible(checked)
+
+    def initiate_new_step(self, text="Launching...", minimum=0, maximum=100):
+        self.find_button.setEnabled(False)
+        self.mailbox_choice.setEnabled(False)
+        self.progress_group.show()
+        self.progress_label.setText(text)
+        self.progress_bar.setRange(minimum, maximum)
+        self.setProgress(minimum)
+
+    def setProgress(self, value):
+        self.progress_bar.setValue(value)
+
+    def get_outlook_dispatch(self, test_existing = False):
+        """Connects to outlook for the first time. But also reconnects if connection was lost.
+        Because unfortunately, win32com is quite unstable when used in multithread."""
+        if test_existing: #If a connection was previously set, we first test it
+            try:
+                a = self.namespace.Folders[self.CurrentAccountName]
+                logging.debug("Connection still OK")
+                return #Connection is OK, we can skip the rest
+            except pythoncom.com_error as e:
+                logging.debug("Com_error. We try to reconnect")
+        try: #First connection, or reconnection required
+            pythoncom.CoInitialize() #Must sometimes be called when win32 is used with multithreadin
+            self.outlook = win32com.client.gencache.EnsureDispatch("Outlook.Application") #Early binding. Also generates Outlook constants
+            self.EarlyBinding = True
+        except:
+            self.outlook = win32com.client.Dispatch("Outlook.Application") #Late binding. Does not generate constants.
+            self.EarlyBinding = False
+        logging.debug(f"Running in early binding? {self.EarlyBinding}")
+        self.namespace = self.outlook.GetNamespace("MAPI")
+
+    def list_mailboxes_b(self, progress_callback): #List all mailboxes at startup
+        #pythoncom.CoInitialize()
+        self.get_outlook_dispatch(False)
+        accounts = self.outlook.Session.Accounts #list all mailboxes available for user
+        for i in range (1, accounts.Count+1): #Populate combo box with list of mailboxes
+            account = accounts.Item(i)
+            self.mailbox_choice.addItem(account.DisplayName)
+
+    def list_mailboxes_b_result(self):
+        for i in range(self.mailbox_choice.count()): #Same mailboxes in mailbox_list, the one chosen ticked
+            item = QtWidgets.QListWidgetItem(self.mailbox_choice.itemText(i), self.mailbox_list)
+            item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+            item.setCheckState(QtCore.Qt.Checked if i == self.mailbox_choice.currentIndex() else QtCore.Qt.Unchecked)
+        self.param_group.show()
+        self.progress_group.hide()
+        self.find_button.setEnabled(True)
+        self.mailbox_choice.setEnabled(True)
+
+    def list_mailboxes_b_error(self): #If we fail to list mailboxes, deactivate find_button
+        self.outlook, self.namespace = None, None
+        self.param_group.show()
+        self.mailbox_choice.addItem("No local mailbox available")
+
+    @QtCore.Slot()
+    def launch_search_f(self): #Triggered by find_button
+        self.OtherMessage = ""
+        self.result_label.setText("") #Reset result text from possible previous execution
+        self.rebuild_cache = self.rebuild_cache_checkbox.isChecked()
+        self.find_copies = self.copies_checkbox.isChecked()
+        self.resume = self.resume_checkbox.isChecked()
+        self.near_threshold = self.NEAR_THRESHOLD if self.near_checkbox.isChecked() else None
+        self.mailboxes = [self.CurrentAccountName]
+        if self.multi_checkbox.isChecked():
+            self.mailboxes = [self.mailbox_list.item(i).text() for i in range(self.mailbox_list.count())
+                if self.mailbox_list.item(i).checkState() == QtCore.Qt.Checked]
+            if not self.mailboxes:
+                self.result_label.setText("Tick at least one mailbox")
+                return
+        self.searching = True
+        self.total_email_count = 0
+        self.new_results_f()
+        self.worker_search = Worker(self.search_duplicates_b)
+        self.worker_search.signals.rows.connect(self.search_duplicates_b_rows)
+        self.worker_search.signals.progress.connect(self.search_duplicates_b_progress)
+        self.worker_search.signals.newStep.connect(self.initiate_new_step)
+        self.worker_search.signals.status.connect(self.progress_label.setText)
+        self.worker_search.signals.result.connect(self.search_duplicates_b_return)
+        self.worker_search.signals.error.connect(self.search_duplicates_b_error)
+        self.threadpool.start(self.worker_search)
+
+    def new_results_f(self): #Empty table of results, filled by search_duplicates_b_rows
+        self.del_model = Delete_TableModel(outlook_engine.MAILBOX_COLS)
+        self.proxyModel = QtCore.QSortFilterProxyModel() #Allow sorting by column
+        self.proxyModel.setSourceModel(self.del_model)
+        self.result_table.setSortingEnabled(True)
+        self.result_table.sortByColumn(0, QtCore.Qt.AscendingOrder)
+        self.del_model.dataChanged.connect(self.update_total) #Receive signal sent by model when selected mails change
+        self.del_model.modelReset.connect(self.update_total)  #Receive signal sent by model when df is updated after deletion
+        self.del_model.rowsInserted.connect(self.update_total) #Receive signal sent by model when new results arrive
+        self.result_table.setModel(self.proxyModel) #Show results in TableView
+
+    @QtCore.Slot()
+    def update_total(self): #Triggered each time the list of selected messages changes. Also called at init
+        self.del_model.partially_checked = False #Totals are maintained by del_model
+        if self.del_model.count_selected_selectable >= self.del_model.count_selectable: #Adapt the selectAll checkbox status. Rows to review checked by hand don't count
+            self.selectAll_checkbox.setCheckState(QtCore.Qt.Checked)
+        elif self.del_model.count_selected == 0:
+            self.selectAll_checkbox.setCheckState(QtCore.Qt.Unchecked)
+        else:
+            self.del_model.partially_checked = True
+            self.selectAll_checkbox.setCheckState(QtCore.Qt.PartiallyChecked)
+        result_text = f"{self.del_model.count_selected} messages marked for deletion out of {self.total_email_count} in inbox, representing {self.del_model.size_selected/1024/1000:.1f} Mo."
+        self.result_label.setText(result_text + " " + self.OtherMessage)
+        #self.OtherMessage = "" #TBD Clear message only when needed
+
+    @QtCore.Slot()
+    def selectAll_changed_f(self, status): #Triggered by the checkbox to select/unselect all messages
+        if status == 2: #QtCore.Qt.Checked: #pyinstaller doesn't convert Qt constants to int !
+            self.del_model.set_all(True) #Select all messages for deletion
+        elif status == 0: #QtCore.Qt.Unchecked:
+            self.del_model.set_all(False) #Deselect all messages
+        elif status == 1: #QtCore.Qt.PartiallyChecked:
+            if not(self.del_model.partially_checked): #Partially_checked can only be set by self.update_total, not by user
+                self.selectAll_checkbox.setCheckState(QtCore.Qt.Checked)
+
+    def print_error_detail(self):
+        ex_type, ex_value, ex_traceback = sys.exc_info() #details of the error
+        trace_back = traceback.extract_tb(ex_traceback)
+        stack_trace = []
+        for trace in trace_back:
+            #stack_trace.append(f"File: {trace[0]}, Line: {trace[1]}, Func.Name: {trace[2]}, Message: {trace[3]}")
+            stack_trace.append(f"Line: {trace[1]}, Func.Name: {trace[2]}, Message: {trace[3]}")
+        logging.debug(f"{ex_type} {ex_type.__name__} {ex_value}")
+        logging.debug(stack_trace)
+
+    def search_duplicates_b(self, progress_callback): #called in background by launch_search_f(self)
+        progress_callback.new_step("Counting emails...", 0, 100)
+        self.get_outlook_dispatch(True)
+        self.namespace_streams = {mailbox: pythoncom.CoMarshalInterThreadInterfaceInStream(pythoncom.IID_IDispatch, self.namespace._oleobj_)
+            for mailbox in self.mailboxes} if not self.READER_PROCESS else {} #Each mailbox is read in its own thread, with the namespace unmarshalled by open_mailbox_b
+        self.sources = {}
+        self.stats = outlook_stats.RunStats(version=self.VERSION, workers=self.COMPARE_WORKERS, mailboxes=self.mailboxes)
+        rows, last_publish = [], time.monotonic()
+        try:
+            for row in outlook_engine.iter_mailboxes(self.mailboxes, self.open_mailbox_b, progress_callback.new_step, progress_callback.progress,
+                    lambda: self.interrupt, self.MAILBOX_THREADS, self.COMPARE_WORKERS, self.stats, self.find_copies, self.near_threshold, progress_callback.set_text):
+                rows.append(row)
+                if time.monotonic() - last_publish >= self.RESULTS_INTERVAL: #Publish results by batches, while conversations are compared
+                    self.total_email_count = sum(source.total_count for source in list(self.sources.values()))
+                    self.worker_search.signals.rows.emit(rows)
+                    rows, last_publish = [], time.monotonic()
+        finally:
+            self.total_email_count = sum(source.total_count for source in self.sources.values())
+            self.worker_search.signals.rows.emit(rows) #Also when interrupted: results found so far can be reviewed
+            self.save_stats()
+        contents_avoided = sum(source.contents_avoided for source in self.sources.values())
+        if contents_avoided:
+            self.OtherMessage = f"({contents_avoided} bodies and attachments not read, as they could not be duplicates)"
+
+    @contextlib.contextmanager
+    def open_mailbox_b(self, mailbox): #Called by outlook_engine.iter_mailboxes in the thread that reads mailbox
+        pythoncom.CoInitialize() #Each thread has its own COM apartment
+        source = None
+        try:
+            if self.READER_PROCESS: #The mailbox is read by a child process, with its own connection to Outlook and its own scan cache
+                source = outlook_process.ProcessSource(functools.partial(outlook_process.open_outlook, mailbox, self.EXCLUDED_FOLDERS,
+                    self.INCLUDE_SUBFOLDERS, self.FOLDER_SIZE_LIMIT, self.SCAN_CACHE, self.CACHE_MAX_ENTRIES, self.rebuild_cache))
+            else:
+                namespace = win32com.client.Dispatch(pythoncom.CoGetInterfaceAndReleaseStream(self.namespace_streams.pop(mailbox), pythoncom.IID_IDispatch))
+                source = outlook_sources.OutlookSource(namespace, mailbox, self.EXCLUDED_FOLDERS, self.INCLUDE_SUBFOLDERS, self.FOLDER_SIZE_LIMIT)
+                if self.SCAN_CACHE: #Opened in the thread of the mailbox, as sqlite connections can't be shared between threads
+                    source.cache = outlook_cache.ScanCache(self.SCAN_CACHE, self.CACHE_MAX_ENTRIES, self.rebuild_cache)
+            self.sources[mailbox] = source
+            self.StoreIDs[mailbox] = source.storeID
+            checkpoint = None
+            if self.SCAN_CHECKPOINT: #Saves the progress, to resume the search if the connection to Outlook is lost or if the user cancels
+                checkpoint = outlook_checkpoint.ScanCheckpoint(outlook_checkpoint.mailbox_path(self.SCAN_CHECKPOINT, mailbox), self.CHECKPOINT_INTERVAL, self.resume)
+            yield source, checkpoint
+        finally:
+            if source is not None:
+                source.close(False) #If the search failed before reading: stops the reader process. Nothing to do otherwise
+                source.namespace = source.top_folder = None #COM objects of this apartment. The counts of source are kept
+            namespace = None
+            pythoncom.CoUninitialize()
+
+    def search_duplicates_b_rows(self, rows): #Called with each batch of results of search_duplicates_b
+        self.del_model.append_rows(rows)
+        if self.del_model.count_deletable and self.result_group.isHidden():
+            self.result_group.show()    #Show widgets that will display results
+            self.result_table.resizeColumnsToContents()
+
+    def search_duplicates_b_return(self, result):
+        self.searching = False
+        self.update_total() #Initiate total
+        self.progress_group.hide()
+        self.find_button.setEnabled(True)
+        self.mailbox_choice.setEnabled(True)
+        self.result_group.show()    #Show widgets that will display results
+        self.result_table.resizeColumnsToContents()
+
+    def search_duplicates_b_progress(self, n,): #call back function to track progress of search_duplicates_b()
+        self.setProgress(n)
+
+    def search_duplicates_b_error(self, err_tuple):
+        self.searching = False
+        self.progress_group.hide()
+        self.find_button.setEnabled(True)
+        self.mailbox_choice.setEnabled(True)
+        #TBD: display a message indicating error
+        self.interrupt = False
+
+    @QtCore.Slot()
+    def export_result_f(self): #Triggered by export_button
+        self.del_model.to_dataframe(self.del_model.displayed_columns).to_clipboard() #Copy list of messages to clipboard
+
+    @QtCore.Slot()
+    def save_session_f(self): #Triggered by save_button
+        path = QtWidgets.QFileDialog.getSaveFileName(self, "Save results",
+            os.path.join(os.path.expanduser("~"), "Outlook_Cleaner_results" + outlook_session.default_extension()),
+            "Parquet (*.parquet);;Arrow (*.arrow);;CSV (*.csv)")[0]
+        if not path:
+            return
+        self.save_button.setEnabled(False)
+        self.worker_save = Worker(self.save_session_b, path)
+        self.worker_save.signals.result.connect(lambda count: self.show_other_message(f"{count} messages saved in {path}"))
+        self.worker_save.signals.error.connect(lambda error_tuple: self.show_other_message(f"Could not save the results: {error_tuple[1]}"))
+        self.worker_save.signals.finished.connect(lambda: self.save_button.setEnabled(True))
+        self.threadpool.start(self.worker_save)
+
+    def save_session_b(self, path, progress_callback): #Called by save_session_f
+        columns, count = self.del_model.columns, self.del_model.count_deletable #Rows added by the search meanwhile are not saved
+        session = outlook_session.SessionWriter(path, outlook_session.search_metadata({mailbox: self.StoreIDs.get(mailbox) for mailbox in self.mailboxes},
+            self.total_email_count, copies=self.find_copies, near_threshold=self.near_threshold))
+        try:
+            for start in range(0, count, outlook_session.SESSION_CHUNK): #By slices of the columns of the table: the table is never copied whole
+                session.write_columns({column: values[start:start + outlook_session.SESSION_CHUNK] for column, values in columns.items()})
+        finally:
+            session.close()
+        return count
+
+    @QtCore.Slot()
+    def open_session_f(self): #Triggered by open_action
+        if self.searching:
+            return
+        path = QtWidgets.QFileDialog.getOpenFileName(self, "Open results", os.path.expanduser("~"), "Results (*.parquet *.arrow *.csv)")[0]
+        if not path:
+            return
+        self.OtherMessage = ""
+        self.result_label.setText("")
+        self.searching = True
+        self.total_email_count = 0
+        self.new_results_f()
+        self.initiate_new_step(f"Loading {os.path.basename(path)}...")
+        self.worker_search = Worker(self.open_session_b, path) #Rows are published as those of a search
+        self.worker_search.signals.rows.connect(self.search_duplicates_b_rows)
+        self.worker_search.signals.result.connect(self.search_duplicates_b_return)
+        self.worker_search.signals.error.connect(self.search_duplicates_b_error)
+        self.worker_search.signals.error.connect(self.open_session_b_error)
+        self.threadpool.start(self.worker_search)
+
+    def open_session_b(self, path, progress_callback): #Called by open_session_f. The messages can then be deleted without searching again
+        metadata = outlook_session.read_metadata(path)
+        self.StoreIDs, self.sources = metadata["StoreIDs"], {}
+        self.mailboxes, self.total_email_count = list(self.StoreIDs), metadata["total_count"]
+        self.find_copies, self.near_threshold = metadata["settings"].get("copies"), metadata["settings"].get("near_threshold")
+        for rows in outlook_session.iter_session(path):
+            self.worker_search.signals.rows.emit(rows)
+        self.OtherMessage = f"(Results saved on {metadata['saved']})"
+
+    def open_session_b_error(self, error_tuple):
+        self.show_other_message(f"Could not open the results: {error_tuple[1]}")
+        self.result_group.show()
+
+    @QtCore.Slot()
+    def delete_selected_f(self): #Triggered by delete_button
+        self.worker_delete = Worker(self.delete_selected_b) #Worker to delete in background
+        self.delete_button.setEnabled(False)
+        if self.searching: #The progress bar follows the search: the deletion is followed under the results
+            self.worker_delete.signals.status.connect(self.show_other_message)
+        else:
+            self.initiate_new_step("Deleting...")
+            self.worker_delete.signals.newStep.connect(self.initiate_new_step)
+            self.worker_delete.signals.progress.connect(self.setProgress)
+            self.worker_delete.signals.status.connect(self.progress_label.setText)
+        self.worker_delete.signals.result.connect(self.delete_selected_b_result)
+        self.worker_delete.signals.error.connect(self.delete_selected_b_error)
+        self.worker_delete.signals.finished.connect(self.delete_selected_b_finished)
+        self.threadpool.start(self.worker_delete)
+
+    def get_namespace(self, reconnect): #Used by outlook_sources.delete_outlook_messages
+        if reconnect:
+            self.get_outlook_dispatch(True) #We test if connection to namespace is still active
+        return self.namespace
+
+    def delete_selected_b(self, progress_callback): #Called by delete_selected_f
+        columns = self.del_model.columns
+        targets = {} #mailbox: [(row, EntryID, folderName)] of the selected messages
+        for row in self.del_model.selected_rows():
+            targets.setdefault(columns["mailbox"][row], []).append((row, columns["ID"][row], columns["folderName"][row]))
+        progress_callback.new_step(f"Deleting {sum(map(len, targets.values()))} messages...", 0, sum(map(len, targets.values())))
+        self.get_outlook_dispatch(True) #We test if connection to namespace is still active
+        stats = None if self.searching else self.stats #self.stats is updated by the search thread
+        if stats is not None:
+            stats.new_stage("delete")
+        deleted, failed = set(), set()
+        for mailbox, mailboxTargets in targets.items(): #Messages are found by EntryID in the store of their mailbox
+            done = len(deleted) + len(failed)
+            if self.StoreIDs[mailbox] is None: #Results of an archive, reloaded from a session
+                failed |= {row for row, ID, folderName in mailboxTargets}
+                continue
+            mailboxDeleted, mailboxFailed = outlook_sources.delete_outlook_messages(mailboxTargets, self.get_namespace, self.StoreIDs[mailbox],
+                lambda n: progress_callback.progress(done + n), lambda: self.interrupt, self.DELETE_RETRIES, stats)
+            deleted |= mailboxDeleted
+            failed |= mailboxFailed
+        if stats is not None:
+            stats.end_stage()
+            self.save_stats()
+        return deleted, failed
+
+    def show_other_message(self, text): #Displays text after the totals, under the results
+        self.OtherMessage = text
+        self.update_total()
+
+    def save_stats(self): #Saves the run report of the last search in RUN_REPORT
+        if self.RUN_REPORT:
+            try:
+                self.stats.save(self.RUN_REPORT)
+            except OSError as e:
+                logging.warning(f"Run report could not be saved in {self.RUN_REPORT}: {e}")
+
+    @QtCore.Slot()
+    def show_stats_f(self): #Triggered by stats_action
+        self.statsText.setPlainText(self.stats.summary() if self.stats else "No search was launched yet")
+        self.statsText.show()
+
+    def delete_selected_b_result(self, result):
+        self.deleted_rows, failed_rows = result
+        if failed_rows:
+            self.OtherMessage = f"Could not delete {len(failed_rows)} emails"
+        elif self.interrupt:
+            self.OtherMessage = f"Deletion interrupted: {len(self.deleted_rows)} messages deleted"
+        else:
+            self.OtherMessage = f"All messages successfully deleted"
+        self.del_model.remove_rows(self.deleted_rows, failed_rows) #Remove the deleted mails, and unselect the others
+
+    def delete_selected_b_error(self, error_tuple):
+        self.OtherMessage = f"Error {error_tuple[0]}. Could not delete some emails"
+
+    def delete_selected_b_finished(self):
+        self.delete_button.setEnabled(True)
+        if self.searching: #The search goes on
+            return
+        self.interrupt = False
+        self.progress_group.hide() #Hide resul bar, and reactivate buttons
+        self.find_button.setEnabled(True)
+        self.mailbox_choice.setEnabled(True)
+
+    def closeEvent(self, event): #Executed when we close the main window
+        pythoncom.CoUninitialize()
+        self.outlook, self.namespace = None, None #Clear references to win32com object. Does not work??
+        #worker_quitOutlook = Worker(self.quitOutlook_b) #Clear references to win32com object. Does not work??
+        #self.threadpool.start(worker_quitOutlook)
+        self.helpText = None #Delete Help window
+        self.statsText = None
+        self.threadpool = None
+        event.accept()
+
+class Delete_TableModel(QtCore.QAbstractTableModel): #will hold the list of deleted mails to be displayed in QTableView
+    """Data is kept as one Python list per column, and display strings are computed once, when first painted.
+    count_selected, count_selected_selectable and size_selected are updated on each change of toDelete"""
+
+    def __init__(self, columns):
+        super().__init__()
+        self.displayed_columns = ["toDelete", "mailbox", "folderName", "subject", "date", "topic", "senderMail", "mess_size", "reason", "similarity", "newerFolder", "newerDate"]
+        self.displayed_header = ["Del", "Mailbox", "Folder", "Subject", "Date", "Topic", "Sender", "Size (Mo)", "Reason", "Similarity", "Newer mail in", "At date"]
+        self.columns = {column: [] for column in columns} #One list per column. Rows are added by append_rows
+        self.toDelete_col = self.displayed_columns.index("toDelete")
+        self.partially_checked = False
+        self.reset_cache()
+
+    def reset_cache(self): #Called each time the lists of self.columns are replaced
+        self.toDelete = self.columns["toDelete"]
+        self.mess_size = self.columns["mess_size"]
+        self.reason = self.columns["reason"]
+        self.values = [self.columns[column] for column in self.displayed_columns] #values[col][row]
+        self.display = [[None] * len(self.toDelete) for column in self.displayed_columns] #Display strings, computed when needed
+        self.count_deletable = len(self.toDelete)
+        self.count_selectable = sum(1 for reason in self.columns["reason"] if reason != "to review") #Select All ignores rows to review
+        self.count_selected = sum(1 for checked in self.toDelete if checked) #Nb of messages selected for deletion
+        self.count_selected_selectable = sum(1 for checked, reason in zip(self.toDelete, self.reason) if checked and reason != "to review")
+        self.size_selected = sum(size for checked, size in zip(self.toDelete, self.mess_size) if checked) #Cumulated size
+
+    def append_rows(self, rows): #Adds rows (tuples of values in the order of self.columns) at the end of the table
+        if not rows:
+            return
+        first = self.count_deletable
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(rows) - 1)
+        for values, new_values in zip(self.columns.values(), zip(*rows)):
+            values.extend(new_values)
+        for display in self.display:
+            display.extend([None] * len(rows))
+        self.count_deletable += len(rows)
+        self.count_selectable += sum(1 for row in rows if row[-2] != "to review")
+        self.count_selected += sum(1 for checked in self.toDelete[first:] if checked)
+        self.count_selected_selectable += sum(1 for checked, reason in zip(self.toDelete[first:], self.reason[first:]) if checked and reason != "to review")
+        self.size_selected += sum(size for checked, size in zip(self.toDelete[first:], self.mess_size[first:]) if checked)
+        self.endInsertRows()
+
+    def to_dataframe(self, columns=None):
+        return pd.DataFrame({column: self.columns[column] for column in columns or self.columns})
+
+    def selected_rows(self):
+        return [row for row, checked in enumerate(self.toDelete) if checked]
+
+    def set_all(self, checked): #Select or unselect all messages
+        if self.count_selected == self.count_selected_selectable == (self.count_selectable if checked else 0):
+            return #Nothing changes: all selectable rows are selected (or none), and no row to review was checked by hand
+        self.toDelete[:] = [checked and reason != "to review" for reason in self.reason] #Near duplicates below the threshold are never selected automatically
+        self.count_selected = self.count_selected_selectable = self.count_selectable if checked else 0
+        self.size_selected = sum(size for selected, size in zip(self.toDelete, self.mess_size) if selected)
+        self.dataChanged.emit(self.index(0, self.toDelete_col), self.index(self.count_deletable - 1, self.toDelete_col))
+
+    def remove_rows(self, removed, unselected=()): #Removes the rows of deleted messages, and unselects the rows unselected
+        self.beginResetModel()
+        for row in unselected:
+            self.toDelete[row] = False
+        kept = [row for row in range(self.count_deletable) if row not in removed]
+        self.columns = {column: [values[row] for row in kept] for column, values in self.columns.items()}
+        self.reset_cache()
+        self.endResetModel()
+
+    def rowCount(self, index):
+        return self.count_deletable
+
+    def columnCount(self, index):
+        return len(self.displayed_columns)
+
+    def headerData(self, section, orientation, role): #Return header of table
+        if role == QtCore.Qt.DisplayRole:
+            if orientation == QtCore.Qt.Horizontal:
+                return self.displayed_header[section]
+            if orientation == QtCore.Qt.Vertical:
+                return None #Do not display line header
+
+    def format_value(self, column_name, value): #Display string of a value
+        if column_name == "mess_size":
+            return f"{value/1024/1000:.1f}" #Display in Mo with 1 decimal
+        elif column_name == "similarity":
+            return "" if value is None else f"{value:.0%}"
+        elif isinstance(value, datetime.datetime):
+            try:
+                return value.strftime("%Y-%m-%d %H:%M:%S") #Format date
+            except:
+                return str(value) #Sometimes, we have an eror "NaTType does not support strftime"
+        return str(value)
+
+    def data(self, index, role): #Return data at index position
+        if not index.isValid():
+            return None
+        row, col = index.row(), index.column()
+        if role == QtCore.Qt.DisplayRole: # or QtCore.Qt.EditRole:
+            if col == self.toDelete_col:
+                return None #We don't display a boolean, but a checkbox
+            text = self.display[col][row]
+            if text is None:
+                text = self.display[col][row] = self.format_value(self.displayed_columns[col], self.values[col][row])
+            return text
+        elif role == QtCore.Qt.CheckStateRole:
+            if col == self.toDelete_col: #In this column, we display a checkbox
+                #return int(QtCore.Qt.Checked if value else QtCore.Qt.Unchecked)
+                return 2 if self.toDelete[row] else 0 #pyinstaller doesn't convert Qt constants to int !
+
+    def flags(self, index): #flags to allow modifications
+        if index.column() == self.toDelete_col: #That column is UserCheckable
+            return QtCore.Qt.ItemIsSelectable|QtCore.Qt.ItemIsEnabled|QtCore.Qt.ItemIsUserCheckable #Qt.ItemIsEditable
+        return QtCore.Qt.ItemIsSelectable
+
+    def setData(self, index, value, role): #Defines what to do when user changes data at index position
+        if not index.isValid():
+            return False
+        if role == QtCore.Qt.CheckStateRole and index.column() == self.toDelete_col:
+            #checked = (value == int(QtCore.Qt.Checked))
+            checked = (value == 2)
+            row = index.row()
+            if checked != bool(self.toDelete[row]): #Update totals with this row only
+                self.count_selected += 1 if checked else -1
+                if self.reason[row] != "to review":
+                    self.count_selected_selectable += 1 if checked else -1
+                self.size_selected += self.mess_size[row] if checked else -self.mess_size[row]
+            self.toDelete[row] = checked
+            self.dataChanged.emit(index, index) #Emit a signal that data changed, and totals must be updated
+            return True
+        return False
+
+def main(config):
+    """Launches the user interface. config is {name: value} of the constants of Outlook - Cleaning.py, passed to the window as arguments"""
+    outlook_engine.set_body_rules(outlook_engine.body_rules(config["BODY_BANNERS"]))
+    app = QtWidgets.QApplication(sys.argv) #Launch Qt
+    myWindow = MainWindow(config["VERSION"], config["HELP_TEXT"], config["FOLDER_SIZE_LIMIT"], config["EXCLUDED_FOLDERS"], config["INCLUDE_SUBFOLDERS"],
+        config["SCAN_CACHE"], config["CACHE_MAX_ENTRIES"], config["COMPARE_WORKERS"], config["READER_PROCESS"], config["MAILBOX_THREADS"],
+        config["FIND_COPIES"], config["SCAN_CHECKPOINT"], config["CHECKPOINT_INTERVAL"], config["RESULTS_INTERVAL"], config["DELETE_RETRIES"],
+        config["RUN_REPORT"], config["NEAR_DUPLICATES"], config["NEAR_THRESHOLD"]) #Create graphical interface
+    myWindow.show() #display window
+    sys.exit(app.exec()) #Launch Qt, and exit properly when window is closed
@@ -0,0 +1,251 @@
+"""Reader process of Outlook - Cleaning.py: a child process owns the connection to Outlook and reads the messages, so that a stalled
+or crashed COM call doesn't freeze or stop the user interface, and COM calls and body normalization don't share the GIL of the analysis.
+The child builds its source (any outlook_sources.MailSource) with a picklable factory, e.g. open_outlook, then answers the requests
+sent by ProcessSource on a pipe. Messages are sent as batches of plain tuples, while the child reads the next ones.
+ProcessSource restarts the child if it dies, stalls or fails, and goes on where it stopped. With a factory of OfflineSource
+or of outlook_benchmark.benchmark_source, it runs on any OS, e.g. to test the protocol without Outlook."""
+import logging, traceback, multiprocessing
+import outlook_engine, outlook_sources, outlook_stats
+from outlook_engine import Message
+
+READ_BATCH = 200 #Messages per batch sent by the child. The child waits when the pipe is full: the parent sets the pace
+READER_TIMEOUT = 300 #Seconds without an answer after which the child is considered stalled, and restarted
+READER_RESTARTS = 3 #Restarts of the child during one search, before its error is raised
+POLL_INTERVAL = 0.5 #Seconds between two checks of interrupted() while waiting for the child
+SOURCE_INFO = ("storeID", "deleted_folder", "excluded_folders", "include_subfolders") #Attributes of the source copied to ProcessSource
+
+class ReaderError(RuntimeError):
+    """Failure of the reader process: error raised in the child (with its traceback), stop or stall"""
+
+def open_outlook(accountName, excluded_folders, include_subfolders, folder_size_limit, scan_cache=None, cache_max_entries=200000, rebuild_cache=False):
+    """Factory of the OutlookSource of accountName, called in the reader process, with its own connection to Outlook and its own scan cache"""
+    import win32com.client, pythoncom #pip install pywin32
+    import outlook_cache
+    pythoncom.CoInitialize()
+    try:
+        outlook = win32com.client.gencache.EnsureDispatch("Outlook.Application") #Early binding
+    except Exception:
+        outlook = win32com.client.Dispatch("Outlook.Application") #Late binding
+    source = outlook_sources.OutlookSource(outlook.GetNamespace("MAPI"), accountName, excluded_folders, include_subfolders, folder_size_limit)
+    if scan_cache:
+        source.cache = outlook_cache.ScanCache(scan_cache, cache_max_entries, rebuild_cache)
+    return source
+
+def send_batches(connection, messages): #Answer of "read" and "fetch": ("messages", batch) messages, and a last ("end", batch)
+    batch = []
+    for mess in messages:
+        batch.append(tuple(mess))
+        if len(batch) >= READ_BATCH:
+            connection.send(("messages", batch))
+            batch = []
+    connection.send(("end", batch))
+
+def serve(connection, factory, normalizer):
+    """Main loop of the reader process. Requests are tuples ("list",), ("read", position, lazy), ("fetch", messages) and ("close", completed).
+    ("resumed", IDs) is answered by ("resumed",). Each one is answered by one message, except "read" and "fetch", answered by batches
+    of messages as they are read (see send_batches).
+    An error is answered by ("error", traceback), and the child waits for the next request"""
+    outlook_engine.BODY_NORMALIZER = normalizer #Rules of the parent, e.g. with its BODY_BANNERS
+    try:
+        source = factory()
+        source.stats = outlook_stats.RunStats() #Latency of the calls of the child, sent back on close
+        connection.send(("ready", {name: getattr(source, name) for name in SOURCE_INFO if hasattr(source, name)}))
+    except Exception:
+        connection.send(("error", traceback.format_exc()))
+        return
+    folders = []
+    while True:
+        try:
+            request, *args = connection.recv()
+        except EOFError: #The parent stopped
+            return
+        try:
+            if request == "list":
+                folders = source.list_folders()
+                connection.send(("folders", [(name, position, getattr(parent, "Name", parent), count, depth)
+                    for position, (name, handle, parent, count, depth) in enumerate(folders)], [source.folder_key(folder) for folder in folders],
+                    source.total_count))
+            elif request == "read":
+                position, source.lazy = args
+                send_batches(connection, source.read_folder(folders[position]))
+            elif request == "resumed":
+                source.folder_resumed(args[0])
+                connection.send(("resumed",))
+            elif request == "fetch":
+                send_batches(connection, source.fetch_contents(Message._make(values) for values in args[0]))
+            elif request == "close":
+                source.close(args[0])
+                connection.send(("closed", source.stats))
+                return
+        except Exception:
+            connection.send(("error", traceback.format_exc()))
+
+class ProcessSource(outlook_sources.MailSource):
+    """Source read by a child process, with the source built by factory() in the child (see serve).
+    Folders are (name, position in the child, name of the parent folder, email_count, depth). Must be closed, to stop the child.
+    A child still sending messages that are not wanted anymore (Cancel, folder left before its end) is terminated, not drained"""
+    lazy = True #Sent with each folder to read, as outlook_engine.iter_duplicates sets it on this source
+
+    def __init__(self, factory, timeout=READER_TIMEOUT, restarts=READER_RESTARTS):
+        self.factory, self.timeout, self.restarts = factory, timeout, restarts
+        self.restarted = 0
+        self.process = None
+        self.keys = [] #folder_key of the folders listed, by position
+        self.positions = {} #folder_key: position of the folder in the child, that changes if the child lists its folders again
+        self.resumed = [] #IDs of the messages of the folders resumed from a checkpoint, told again to a new child
+        self.stats = outlook_stats.RunStats() #Latency of the calls of the child, merged on close
+        self.start()
+
+    def start(self):
+        context = multiprocessing.get_context("spawn") #As on Windows: the child doesn't inherit the COM objects of the parent
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=serve, args=(child, self.factory, outlook_engine.BODY_NORMALIZER), daemon=True)
+        self.process.start()
+        child.close()
+        self.busy = False #True while the child sends the messages of a folder
+        for name, value in self.receive()[0].items():
+            setattr(self, name, value)
+
+    def interrupted(self): #Replaced by the interrupted() of the search (see outlook_engine.iter_duplicates)
+        return False
+
+    def stop(self, terminate=False):
+        self.connection.close()
+        if terminate:
+            self.process.terminate()
+        self.process.join(5)
+        if self.process.is_alive(): #Stalled in a COM call
+            self.process.terminate()
+            self.process.join()
+        self.process = None
+
+    def stopped(self): #Message of the unexpected end of the child
+        self.process.join(1)
+        return f"The reader process stopped (exit code {self.process.exitcode})"
+
+    def restart(self, error):
+        """Replaces the child after error, or raises error once restarts are exhausted.
+        The new child lists its folders again, to find the ones of the first list"""
+        while True:
+            if self.restarted >= self.restarts:
+                raise error
+            self.restarted += 1
+            self.stats.counters["reader_restarts"] += 1
+            logging.warning(f"Reader process failed, it is restarted ({self.restarted}/{self.restarts}): {error}")
+            self.stop()
+            try:
+                self.replace()
+                return
+            except ReaderError as e: #The new child failed too
+                error = e
+
+    def replace(self):
+        """Starts a new child, that lists its folders again if they were listed, to find the ones of the first list"""
+        self.start()
+        if self.keys:
+            self.send("list")
+            folders, keys, total_count = self.receive()
+            self.positions = {key: position for position, key in enumerate(keys)}
+        if self.resumed:
+            self.send("resumed", self.resumed)
+            self.receive()
+
+    def send(self, *request):
+        if self.busy: #A folder was not read until its end: the child is replaced, rather than waiting for its last messages
+            self.stop(terminate=True)
+            self.replace()
+        try:
+            self.connection.send(request)
+        except OSError as e:
+            raise ReaderError(self.stopped()) from e
+        self.busy = request[0] in ("read", "fetch")
+
+    def receive(self):
+        """Returns the values of the next message of the child. Raises ReaderError if it failed, stopped or stalled,
+        and KeyboardInterrupt if interrupted() while waiting"""
+        waited = 0
+        try:
+            while not self.connection.poll(POLL_INTERVAL):
+                if self.interrupted():
+                    raise KeyboardInterrupt("User clicked on Cancel")
+                waited += POLL_INTERVAL
+                if waited >= self.timeout:
+                    raise ReaderError(f"No answer of the reader process for {self.timeout} s")
+            kind, *values = self.connection.recv()
+        except (EOFError, OSError) as e:
+            raise ReaderError(self.stopped()) from e
+        if kind in ("end", "error"):
+            self.busy = False
+        if kind == "error":
+            raise ReaderError(values[0])
+        return values
+
+    def call(self, *request):
+        """Sends request and returns the values of the answer, sent again to a new child if the child fails"""
+        while True:
+            try:
+                self.send(*request)
+                return self.receive()
+            except ReaderError as e:
+                self.restart(e)
+
+    def list_folders(self):
+        folders, self.keys, self.total_count = self.call("list")
+        self.positions = {key: position for position, key in enumerate(self.keys)}
+        return folders
+
+    def folder_key(self, folder):
+        return self.keys[folder[1]]
+
+    def folder_resumed(self, IDs):
+        self.resumed += IDs
+        self.call("resumed", IDs)
+
+    def read_folder(self, folder):
+        yielded = set() #IDs of the messages yielded, not to yield them twice if the child is restarted in the folder
+        while True:
+            position = self.positions.get(self.keys[folder[1]])
+            if position is None:
+                raise ReaderError(f"{folder[0]} changed while the reader process was restarted")
+            try:
+                self.send("read", position, self.lazy)
+                while self.busy:
+                    for values in self.receive()[0]:
+                        if values[2] not in yielded: #ID
+                            yielded.add(values[2])
+                            yield Message._make(values)
+                return
+            except ReaderError as e:
+                self.restart(e)
+
+    def fetch_content(self, mess):
+        return next(self.fetch_contents([mess]))
+
+    def fetch_contents(self, messages):
+        """Yields the messages with their body and atts, read by the child while the previous ones are treated"""
+        messages = [tuple(mess) for mess in messages]
+        count = 0 #Messages yielded. The others are asked again to a new child if the child is restarted
+        while count < len(messages):
+            try:
+                self.send("fetch", messages[count:])
+                while self.busy:
+                    for values in self.receive()[0]:
+                        count += 1
+                        yield Message._make(values)
+            except ReaderError as e:
+                self.restart(e)
+
+    def close(self, completed):
+        if self.process is None:
+            return
+        if self.busy: #Cancel while the child reads: its cache keeps what it committed, its stats are lost
+            logging.info("The reader process is terminated")
+            self.stop(terminate=True)
+            return
+        try:
+            self.send("close", completed)
+            self.stats.merge(self.receive()[0], "reader")
+        except ReaderError as e:
+            logging.warning(f"The reader process could not be closed: {e}")
+        finally:
+            self.stop()
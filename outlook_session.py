@@ -0,0 +1,149 @@
+"""Sessions of Outlook - Cleaning.py: the results of a search saved to disk, with what is needed to delete them later
+(the StoreID of each mailbox, and the EntryIDs), so that they can be reloaded without searching again.
+Sessions are written in Parquet (.parquet) or Arrow IPC (.arrow) with pyarrow, or in CSV (.csv) without it.
+Rows are written and read by chunks of SESSION_CHUNK rows: memory stays flat whatever the number of results."""
+import os, csv, json, datetime
+import outlook_engine
+try:
+    import pyarrow, pyarrow.parquet, pyarrow.ipc #pip install pyarrow. Optional: sessions are saved in CSV without it
+except ImportError:
+    pyarrow = None
+
+SESSION_CHUNK = 10000 #Rows per Parquet row group or Arrow batch, and per batch of rows read
+FORMAT_VERSION = 1 #To change when the columns or the metadata change
+METADATA_KEY = b"outlook_cleaner" #Key of the metadata in the schema of Parquet and Arrow files
+DATE_COLS = ("date", "newerDate")
+NULLABLE_COLS = outlook_engine.NEWER_COLS + ["similarity", "conversationID", "senderMail"] #Empty in CSV when None (e.g. receipts have
+#no newer message, nor sender). In CSV, an empty text of these columns is read back as None
+
+def search_metadata(StoreIDs, total_count, **settings):
+    """Metadata of the session of a search. StoreIDs is {mailbox: StoreID}, with None for an archive: its messages can't be deleted"""
+    return {"StoreIDs": dict(StoreIDs), "total_count": total_count, "settings": settings}
+
+def session_format(path):
+    """"parquet", "arrow" or "csv", from the extension of path"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in (".parquet", ".arrow", ".feather"):
+        return "csv"
+    if pyarrow is None:
+        raise ImportError(f"pyarrow is required for {ext} sessions (pip install pyarrow). Use a .csv file instead")
+    return "parquet" if ext == ".parquet" else "arrow"
+
+def default_extension(): #Most compact format available
+    return ".parquet" if pyarrow is not None else ".csv"
+
+def arrow_schema(columns, header):
+    types = {"date": pyarrow.timestamp("us"), "newerDate": pyarrow.timestamp("us"), "toDelete": pyarrow.bool_(),
+        "mess_size": pyarrow.int64(), "similarity": pyarrow.float64()}
+    return pyarrow.schema([(column, types.get(column, pyarrow.string())) for column in columns],
+        metadata={METADATA_KEY: json.dumps(header, ensure_ascii=False)})
+
+class SessionWriter:
+    """Writes result rows (columns, MAILBOX_COLS by default) to a session file, as they come or by slices of columns.
+    metadata (JSON values: StoreIDs as {mailbox: StoreID}, total_count, settings of the search) is saved in the schema
+    of Parquet and Arrow files, and in path + ".json" for CSV files"""
+    def __init__(self, path, metadata, columns=outlook_engine.MAILBOX_COLS):
+        self.path, self.columns = path, list(columns)
+        self.format = session_format(path)
+        self.pending = [] #Rows not written yet
+        self.count = 0
+        header = {"version": FORMAT_VERSION, "saved": datetime.datetime.now().isoformat(timespec="seconds"), "columns": self.columns, **metadata}
+        if self.format == "csv":
+            with open(path + ".json", "w", encoding="utf-8") as f:
+                json.dump(header, f, indent=2, ensure_ascii=False)
+            self.file = open(path, "w", newline="", encoding="utf-8")
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(self.columns)
+        else:
+            self.schema = arrow_schema(self.columns, header)
+            if self.format == "parquet":
+                self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+            else:
+                self.writer = pyarrow.ipc.new_file(path, self.schema)
+
+    def write_row(self, row):
+        self.pending.append(row)
+        if len(self.pending) >= SESSION_CHUNK:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            rows, self.pending = self.pending, []
+            self.write_columns(dict(zip(self.columns, map(list, zip(*rows)))))
+
+    def write_columns(self, values):
+        """Writes the rows given as {column: list of values}, e.g. slices of the lists of a table"""
+        values = [values[column] for column in self.columns]
+        if self.format == "csv":
+            self.csv.writerows([[format_csv(value) for value in row] for row in zip(*values)])
+        else:
+            batch = pyarrow.record_batch([pyarrow.array(column, type=field.type) for column, field in zip(values, self.schema)], schema=self.schema)
+            self.writer.write_batch(batch)
+        self.count += len(values[0])
+
+    def close(self):
+        self.flush()
+        if self.format == "csv":
+            self.file.close()
+        else:
+            self.writer.close()
+
+def format_csv(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+def parse_csv(column, value):
+    if value == "" and column in NULLABLE_COLS:
+        return None
+    if column in DATE_COLS:
+        return datetime.datetime.fromisoformat(value)
+    if column == "toDelete":
+        return value == "True"
+    if column == "mess_size":
+        return int(value)
+    if column == "similarity":
+        return float(value)
+    return value
+
+def read_metadata(path):
+    """Metadata of the session saved in path, with its "columns". Raises ValueError if it is not a session of this version"""
+    try:
+        if session_format(path) == "csv":
+            with open(path + ".json", encoding="utf-8") as f:
+                metadata = json.load(f)
+        else:
+            schema = pyarrow.parquet.read_schema(path) if session_format(path) == "parquet" else pyarrow.ipc.open_file(path).schema
+            metadata = json.loads((schema.metadata or {})[METADATA_KEY])
+    except (KeyError, ValueError) as e: #No metadata, or not JSON. pyarrow.ArrowInvalid (not an Arrow file) is a ValueError
+        raise ValueError(f"{path} is not a saved search: {e!r}")
+    if metadata.get("version") != FORMAT_VERSION:
+        raise ValueError(f"{path} was saved by another version (format {metadata.get('version')}, expected {FORMAT_VERSION})")
+    return metadata
+
+def iter_session(path, columns=outlook_engine.MAILBOX_COLS):
+    """Yields the rows of the session saved in path, by lists of at most SESSION_CHUNK tuples of the values of columns"""
+    format = session_format(path)
+    if format == "csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            positions = [header.index(column) for column in columns]
+            rows = []
+            for values in reader:
+                rows.append(tuple(parse_csv(column, values[position]) for column, position in zip(columns, positions)))
+                if len(rows) >= SESSION_CHUNK:
+                    yield rows
+                    rows = []
+            if rows:
+                yield rows
+        return
+    if format == "parquet":
+        batches = pyarrow.parquet.ParquetFile(path).iter_batches(SESSION_CHUNK, columns=columns)
+    else:
+        reader = pyarrow.ipc.open_file(pyarrow.memory_map(path))
+        batches = (reader.get_batch(i).select(columns) for i in range(reader.num_record_batches))
+    for batch in batches:
+        yield list(zip(*(batch.column(column).to_pylist() for column in columns)))
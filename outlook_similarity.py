@@ -0,0 +1,180 @@
+"""Near-duplicate search of Outlook - Cleaning.py: finds messages whose text is almost entirely quoted in a newer message,
+when the reply re-wrapped the lines, changed the quote prefixes or rewrote the signature, so that the exact test of compare_conversation fails.
+Bodies are cut in shingles of SHINGLE_WORDS words, summarized by MinHash signatures (computed with NumPy, a batch of messages at a time),
+and LSH banding proposes candidate pairs in the whole mailbox, across conversations, without pairwise comparison. Within a conversation,
+older and newer messages are also paired: LSH misses a short message quoted in a long reply, as their Jaccard similarity is low.
+Signatures only propose pairs: each candidate is decided on the exact part of the shingles of the older message found in the newer one."""
+import re, zlib, logging, functools
+import numpy as np #pip install numpy. Installed with pandas
+
+SHINGLE_WORDS = 4 #Words per shingle
+NUM_PERM = 64 #Hash functions of a MinHash signature
+BANDS = 32 #LSH bands of NUM_PERM // BANDS values. Pairs of Jaccard similarity above about (1/BANDS)**(BANDS/NUM_PERM) become candidates
+MIN_SIMILARITY = 0.6 #Lowest score reported. Between MIN_SIMILARITY and the threshold of the search, messages are proposed but never selected
+MAX_BUCKET = 50 #Above this number of messages sharing a band (e.g. notifications), or in a conversation, only messages close in date are paired
+SHINGLE_CACHE = 1024 #Shingle sets kept while candidates are checked, sorted by older message
+BATCH_SHINGLES = 50000 #Shingles hashed at once, to bound memory
+WORD = re.compile(r"\w+")
+SHINGLE_PRIME = np.uint64(1000003)
+
+class MinHasher:
+    """MinHash signatures of bodies: the minimum, over the distinct shingles of a body, of NUM_PERM multiply-shift hash functions"""
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1) #Odd multipliers
+        self.b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+        self.word_hashes = {} #word: crc32
+
+    def shingles(self, body):
+        """Distinct 32-bit hashes of the shingles of body. Case, punctuation, quote prefixes and line breaks are ignored"""
+        hashes = self.word_hashes
+        words = WORD.findall(body.lower())
+        for word in words:
+            if word not in hashes:
+                hashes[word] = zlib.crc32(word.encode("utf-8", "surrogatepass"))
+        values = np.array([hashes[word] for word in words], dtype=np.uint64)
+        if len(values) == 0:
+            return values
+        count = max(len(values) - SHINGLE_WORDS + 1, 1) #A body shorter than a shingle is a single shingle
+        shingles = values[:count].copy()
+        for i in range(1, min(SHINGLE_WORDS, len(values))):
+            shingles = shingles * SHINGLE_PRIME + values[i:i+count]
+        return np.unique(shingles & np.uint64(0xFFFFFFFF))
+
+    def signatures(self, bodies, progress=None):
+        """Returns the signatures of bodies (array of len(bodies) x NUM_PERM), and their numbers of distinct shingles.
+        Bodies without any word have no shingle, and a signature that matches nothing"""
+        signatures = np.full((len(bodies), len(self.a)), 2**32, dtype=np.uint64)
+        sizes = np.zeros(len(bodies), dtype=np.int64)
+        batch, positions, count = [], [], 0
+        for position, body in enumerate(bodies):
+            shingles = self.shingles(body)
+            sizes[position] = len(shingles)
+            if len(shingles):
+                batch.append(shingles)
+                positions.append(position)
+                count += len(shingles)
+            if count >= BATCH_SHINGLES or position == len(bodies) - 1:
+                if batch:
+                    self.hash_batch(batch, positions, signatures)
+                    batch, positions, count = [], [], 0
+                if progress is not None:
+                    progress(position + 1)
+        return signatures, sizes
+
+    def hash_batch(self, batch, positions, signatures):
+        shingles = np.concatenate(batch)
+        starts = np.cumsum([0] + [len(shingles) for shingles in batch[:-1]])
+        hashes = (shingles[:, None] * self.a[None, :] + self.b[None, :]) >> np.uint64(32) #Multiply-shift: 32 bits hashes
+        signatures[positions] = np.minimum.reduceat(hashes, starts, axis=0)
+
+@functools.lru_cache(maxsize=MAX_BUCKET)
+def triangle(size): #All pairs of positions in a bucket of size messages
+    return np.triu_indices(size, 1)
+
+def candidate_pairs(signatures, valid, order, bands=BANDS):
+    """Returns the pairs of positions (first, second), first < second, that share at least one band of their signatures.
+    Only valid positions are paired. order gives the rank of each position, to pair neighbours when a bucket is too big"""
+    rows = signatures.shape[1] // bands
+    positions = np.flatnonzero(valid)
+    pairs = []
+    for band in range(bands):
+        keys = np.zeros(len(positions), dtype=np.uint64)
+        for column in signatures[positions, band*rows:(band+1)*rows].T:
+            keys = keys * SHINGLE_PRIME + column
+        sort = np.argsort(keys, kind="stable")
+        sortedKeys = keys[sort]
+        starts = np.flatnonzero(np.r_[True, sortedKeys[1:] != sortedKeys[:-1]])
+        sizes = np.diff(np.r_[starts, len(keys)])
+        twins = starts[sizes == 2] #Most buckets of several messages have two messages
+        pairs.append(np.stack([positions[sort[twins]], positions[sort[twins + 1]]], axis=1))
+        for start, size in zip(starts[sizes > 2], sizes[sizes > 2]):
+            members = positions[sort[start:start+size]]
+            if size > MAX_BUCKET:
+                members = members[np.argsort(order[members], kind="stable")]
+                pairs.append(np.stack([members[:-1], members[1:]], axis=1))
+            else:
+                first, second = triangle(size)
+                pairs.append(np.stack([members[first], members[second]], axis=1))
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    pairs = np.concatenate(pairs)
+    pairs.sort(axis=1)
+    return np.unique(pairs, axis=0)
+
+def conversation_pairs(conversations, order):
+    """Returns the pairs of positions (first, second), first < second, of the same conversation (conversations: an array of ids by position).
+    In conversations of more than MAX_BUCKET messages, a message is only paired with the MAX_BUCKET - 1 next ones in order"""
+    sort = np.lexsort((order, conversations))
+    sortedConversations = conversations[sort]
+    starts = np.flatnonzero(np.r_[True, sortedConversations[1:] != sortedConversations[:-1]])
+    sizes = np.diff(np.r_[starts, len(sort)])
+    pairs = [np.stack([sort[starts[sizes == 2]], sort[starts[sizes == 2] + 1]], axis=1)]
+    for start, size in zip(starts[sizes > 2], sizes[sizes > 2]):
+        members = sort[start:start+size]
+        if size > MAX_BUCKET:
+            pairs += [np.stack([members[:-offset], members[offset:]], axis=1) for offset in range(1, MAX_BUCKET)]
+        else:
+            first, second = triangle(size)
+            pairs.append(np.stack([members[first], members[second]], axis=1))
+    pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+    pairs.sort(axis=1)
+    return pairs
+
+def containment(shingles, other):
+    """Part of the shingles (distinct hashes, see MinHasher.shingles) found in other"""
+    return len(np.intersect1d(shingles, other, assume_unique=True)) / max(len(shingles), 1)
+
+def find_similar(store, reported, deleted_folder, threshold, newStep, progress, interrupted, stats=None):
+    """Similar stage: returns the rows (RESULT_COLS) of the messages of store (outlook_engine.MessageStore) whose shingles are
+    at least MIN_SIMILARITY contained in a newer message, that has all their attachments. Same folder rules as compare_conversation.
+    Candidates are proposed by LSH and by conversation, then similarity is the exact part of the shingles of the message found in the newer one.
+    Messages of at least threshold similarity
+    have the reason "similar". Below threshold, the reason is "to review": they are proposed, but never selected for deletion.
+    Messages whose ID is in reported (already found by the other stages) are not reported again"""
+    if stats is not None:
+        stats.new_stage("similar")
+    rows = [row for row in range(len(store)) if store.has_body(row)]
+    newStep(f"Step 3/3 - Find messages similar to a newer one, among {len(rows)}", 0, len(rows))
+    signatures, sizes = MinHasher().signatures([store.body(row) for row in rows], progress)
+    if interrupted():
+        raise KeyboardInterrupt("User clicked on Cancel")
+    dates = np.array([store.dates[row] for row in rows], dtype=np.int64)
+    conversations = np.unique([store.conversationID[row] for row in rows], return_inverse=True)[1].reshape(-1)
+    pairs = np.concatenate([candidate_pairs(signatures, sizes > 0, dates), conversation_pairs(conversations, dates)])
+    pairs = np.unique(pairs, axis=0) if len(pairs) else pairs
+    first, second = pairs[:, 0], pairs[:, 1]
+    older = np.where(dates[first] <= dates[second], first, second)
+    newer = np.where(dates[first] <= dates[second], second, first)
+    #The newer message must be strictly more recent, and have enough shingles to contain MIN_SIMILARITY of the older one
+    keep = (dates[older] < dates[newer]) & (sizes[older] > 0) & (sizes[newer] >= MIN_SIMILARITY * sizes[older])
+    older, newer = older[keep], newer[keep]
+    sort = np.argsort(older, kind="stable") #Shingles of the older message computed once
+    hasher = MinHasher()
+    @functools.lru_cache(maxsize=SHINGLE_CACHE)
+    def shingles(position):
+        return hasher.shingles(store.body(rows[position]))
+    best = {} #Position of the older message: (similarity, position of the newer message)
+    checked = 0
+    for old, new in zip(older[sort].tolist(), newer[sort].tolist()):
+        oldRow, newRow = rows[old], rows[new]
+        if store.ID[oldRow] in reported or (store.folderName[newRow] == deleted_folder and store.folderName[oldRow] != deleted_folder):
+            continue
+        if not set(store.atts[oldRow]) <= set(store.atts[newRow]):
+            continue
+        checked += 1
+        if checked % 10000 == 0 and interrupted():
+            raise KeyboardInterrupt("User clicked on Cancel")
+        score = containment(shingles(old), shingles(new))
+        if score >= MIN_SIMILARITY and (old not in best or score > best[old][0]):
+            best[old] = (score, new)
+    results = []
+    for old, (score, new) in sorted(best.items()):
+        mess, mess2 = store.message(rows[old]), store.message(rows[new])
+        results.append((mess.folderName, mess.conversationID, mess.ID, mess.date, mess.subject, mess.topic, mess.senderMail, mess.toDelete,
+            mess.mess_size, mess2.ID, mess2.folderName, mess2.date, "similar" if score >= threshold else "to review", round(score, 3)))
+    logging.info(f"{len(results)} similar messages found among {len(pairs)} candidate pairs")
+    if stats is not None:
+        stats.counters.update(similar_candidates=len(pairs), similar_checked=checked, similar=sum(1 for row in results if row[-2] == "similar"),
+            to_review=sum(1 for row in results if row[-2] == "to review"))
+    return results
@@ -0,0 +1,486 @@
+"""Mail sources read by outlook_engine.search_duplicates. A source lists its folders, and yields outlook_engine.Message records folder by folder.
+OutlookSource reads a mailbox through win32com. OfflineSource reads exported archives (Maildir, mbox, or folders of .eml files)
+with the standard library, so that duplicates can be searched without Outlook, on any OS."""
+import os, re, time, datetime, itertools, logging, mailbox, email, email.errors, email.header, email.utils, html
+from outlook_engine import Message, normalize_body
+import outlook_stats
+
+#https://docs.microsoft.com/fr-fr/office/vba/api/outlook.oldefaultfolders
+OL_FOLDER_DELETED_ITEMS = 3
+OL_EXCLUDED_DEFAULT_FOLDERS = [20, 10, 16, 11, 25] #SyncIssues, Contacts, Drafts, Journal, RssFeeds are never scanned
+#Properties read in bulk with Folder.GetTable. https://docs.microsoft.com/en-us/office/vba/api/outlook.table
+TABLE_COLUMNS = ["EntryID", "LastModificationTime", "CreationTime", "Subject", "ConversationTopic", "ConversationID", "UnRead",
+    "SenderName", "SenderEmailAddress", "Size", "MessageClass", "ConversationIndex"]
+TABLE_BATCH = 500 #Rows returned by each Table.GetArray call
+NO_SENDER_CLASSES = ("REPORT.", "IPM.Outlook.Recall") #Undelivered or recalled receipts: items without a SenderName property
+DELETE_BATCH = 50 #Messages deleted between two checks of Cancel and progress updates
+RESTRICT_DATE_FORMAT = "%m/%d/%Y %I:%M %p" #Dates in Items.Restrict filters. Outlook compares them to the minute
+
+class MailSource:
+    """Generic mail source. Folders are tuples (name, folder, parent_folder, email_count, depth), as built by get_subFolders.
+    folder is an opaque handle, only used by read_folder"""
+    storeID = None #Identifies the mailbox, e.g. to delete messages later
+    deleted_folder = None #Name of the folder of deleted messages
+    total_count = 0 #Number of messages in the folders to scan, set by list_folders
+    contents_read, contents_avoided = 0, 0 #Set by outlook_engine.fetch_contents
+    stats = None #outlook_stats.RunStats of the search, set by outlook_engine.iter_duplicates
+
+    def list_folders(self):
+        raise NotImplementedError
+
+    def read_folder(self, folder): #Yields the Message records of a folder returned by list_folders. body and atts may be None if not read yet
+        raise NotImplementedError
+
+    def fetch_content(self, mess): #Returns mess with the body and atts that read_folder did not read, or unchanged if it can't be read anymore
+        raise NotImplementedError
+
+    def fetch_contents(self, messages): #Yields the messages with their body and atts, in the same order. A source may read them ahead
+        for mess in messages:
+            yield self.fetch_content(mess)
+
+    def folder_key(self, folder): #Identifies a folder returned by list_folders from one search to the next, e.g. to resume a search
+        raise NotImplementedError
+
+    def folder_resumed(self, IDs): #Called with the IDs of the messages of a folder read by an interrupted search, that is not read again
+        pass
+
+    def close(self, completed): #Called when reading ends. completed is False if it was interrupted
+        pass
+
+class OutlookSource(MailSource):
+    """Reads the mailbox accountName of an Outlook MAPI namespace. Must be used in the thread that owns the namespace."""
+    cache = None #Optional outlook_cache.ScanCache, to read only new or modified messages
+    lazy = True #Bodies and attachments are read later by fetch_content, only for messages that can be compared
+    use_table = True #Properties are read in bulk with Folder.GetTable, instead of one COM call per property and message
+
+    def __init__(self, namespace, accountName, excluded_folders, include_subfolders, folder_size_limit):
+        """Folders of folder_size_limit items or more are read in windows of CreationTime of about that size"""
+        self.namespace = namespace
+        inbox = namespace.Folders[accountName] #Inbox of the chosen mailbox
+        try:
+            self.top_folder = inbox
+            #self.top_folder = inbox.Folders["4-SUPP"].Folders["Réunions"] #DEBUG
+            #self.top_folder = inbox.Folders["Boîte de réception"] Éléments supprimés
+            #self.top_folder = inbox.Folders["Éléments supprimés"]
+        except:
+            logging.critical("You have forced top_folder to a value that does not exist in this mailbox. Please modify code")
+        self.storeID = self.top_folder.StoreID
+        self.deleted_folder = namespace.GetDefaultFolder(OL_FOLDER_DELETED_ITEMS).Name #Deleted Items Folder name
+        self.excluded_folders = excluded_folders + [namespace.GetDefaultFolder(id).Name for id in OL_EXCLUDED_DEFAULT_FOLDERS]
+        self.include_subfolders = include_subfolders
+        self.folder_size_limit = folder_size_limit
+        self.stats = outlook_stats.RunStats() #Latency of COM calls
+        self.resumed_IDs = set() #Messages of the folders resumed from a checkpoint, whose content may be in cache
+
+    def list_folders(self):
+        folders, self.total_count = self.get_subFolders(self.top_folder, '', 1) #List all subfolders
+        return folders
+
+    def get_subFolders(self, top_folder, parent_folder='', n=1):
+        """Recursively Returns all the sub-folders of top_folder if include_subfolders==True"""
+        if top_folder.Name in self.excluded_folders:
+            subFolders, email_count = [], 0
+        else:
+            start = time.perf_counter()
+            email_count = top_folder.Items.Count
+            self.stats.record("Items.Count", start)
+            if email_count < self.folder_size_limit:
+                subFolders = [(top_folder.Name, top_folder, parent_folder, email_count, n)]
+            else: #Big folders are read by windows of CreationTime, to keep Items collections small
+                windows = self.get_windows(top_folder)
+                windows_count = sum(window_count for window, window_count in windows)
+                if windows_count == email_count:
+                    subFolders = [(top_folder.Name, window, parent_folder, window_count, n) for window, window_count in windows]
+                    logging.info(f"{top_folder.Name} has {email_count} items. It will be read in {len(subFolders)} windows")
+                else: #Restrict read the dates of the filters in another format (RESTRICT_DATE_FORMAT is the US one), or the folder changed
+                    subFolders = [(top_folder.Name, top_folder, parent_folder, email_count, n)]
+                    logging.warning(f"The windows of {top_folder.Name} have {windows_count} items instead of {email_count}. It will be read without windows")
+            if self.include_subfolders:
+                for f in top_folder.Folders: #List sub-folders recursively
+                    if f.DefaultMessageClass == "IPM.Note":
+                        subFolders2, email_count2 = self.get_subFolders(f, top_folder, n+1)
+                        subFolders += subFolders2
+                        email_count += email_count2
+        return subFolders, email_count
+
+    def get_windows(self, folder):
+        """Splits folder in FolderWindows, in chronological order, of at most folder_size_limit items when possible.
+        Returns [(window, email_count)]"""
+        items = folder.Items
+        items.Sort("[CreationTime]")
+        first, last = items.GetFirst().CreationTime, items.GetLast().CreationTime
+        start = datetime.datetime(first.year, first.month, first.day, first.hour, first.minute) #Restrict compares to the minute
+        end = datetime.datetime(last.year, last.month, last.day, last.hour, last.minute) + datetime.timedelta(minutes=1)
+        windows = []
+        self.split_window(FolderWindow(folder, start, end), windows)
+        return windows
+
+    def split_window(self, window, windows): #Appends window to windows, or its two halves if it has too many items
+        start = time.perf_counter()
+        email_count = window.folder.Items.Restrict(window.filter).Count
+        self.stats.record("Items.Restrict", start)
+        middle = window.start + (window.end - window.start) // 2
+        middle = middle.replace(second=0, microsecond=0)
+        if email_count >= self.folder_size_limit and window.start < middle:
+            self.split_window(FolderWindow(window.folder, window.start, middle), windows)
+            self.split_window(FolderWindow(window.folder, middle, window.end), windows)
+        elif email_count:
+            windows.append((window, email_count))
+
+    def folder_key(self, folder): #Changes with the number of items, so that a folder that changed is read again
+        handle, filter = folder[1], None
+        if isinstance(handle, FolderWindow):
+            handle, filter = handle.folder, handle.filter
+        return (handle.EntryID, filter, folder[3])
+
+    def folder_resumed(self, IDs):
+        if self.cache:
+            self.cache.touch(self.storeID, IDs) #Still in the mailbox: not to be purged at the end of the search
+            self.resumed_IDs.update(IDs)
+
+    def read_folder(self, folder):
+        folder, filter = folder[1], None
+        if isinstance(folder, FolderWindow):
+            folder, filter = folder.folder, folder.filter
+        if self.use_table:
+            try:
+                rows = self.read_table(folder, filter)
+            except Exception as e: #Some stores don't support tables
+                logging.warning(f"Table of {folder.Name} could not be read ({e}). Messages are read one by one")
+            else:
+                return self.read_folder_table(folder, rows)
+        return self.read_folder_items(folder, filter)
+
+    def read_table(self, folder, filter=None):
+        """Returns a generator of {column: value} for all items of folder (matching filter), read in bulk by Folder.GetTable.
+        Columns that the Table can't provide are read on each item, through GetItemFromID"""
+        start = time.perf_counter()
+        table = folder.GetTable(filter) if filter else folder.GetTable()
+        self.stats.record("Folder.GetTable", start)
+        table.Columns.RemoveAll()
+        columns, missing = [], []
+        for column in TABLE_COLUMNS:
+            try:
+                table.Columns.Add(column)
+                columns.append(column)
+            except Exception:
+                missing.append(column)
+        if "EntryID" not in columns:
+            raise ValueError("EntryID is not available in the table")
+        if missing:
+            logging.debug(f"Read one by one in {folder.Name}: {missing}")
+        def rows():
+            while not table.EndOfTable:
+                start = time.perf_counter()
+                batch = table.GetArray(TABLE_BATCH)
+                self.stats.record("Table.GetArray", start)
+                for row in batch:
+                    values = dict(zip(columns, row))
+                    if missing:
+                        start = time.perf_counter()
+                        item = self.namespace.GetItemFromID(values["EntryID"], self.storeID)
+                        values.update((column, getattr(item, column, None)) for column in missing)
+                        self.stats.record("Table missing columns", start)
+                    yield values
+        return rows()
+
+    def read_folder_table(self, folder, rows):
+        folderName = folder.Name
+        for values in rows:
+            ID, modified = values["EntryID"], values["LastModificationTime"]
+            record = self.cache.get(self.storeID, ID, modified, folderName) if self.cache else None
+            if record is None: #Not in cache, or modified since it was cached
+                date = values["CreationTime"]
+                date = datetime.datetime.combine(date.date(), date.time()) #convert to datetime
+                senderName = values["SenderName"]
+                if (values["MessageClass"] or "").startswith(NO_SENDER_CLASSES):
+                    senderName = None
+                isUnread = bool(values["UnRead"])
+                if senderName is None: #Recalled or undelivered messages have no sender
+                    toDelete, body, atts = isUnread==False, "", [] #delete only unread messages
+                else:
+                    toDelete, body, atts = False, None, None
+                record = Message(folderName, values["ConversationID"], ID, date, values["Subject"], (values["ConversationTopic"] or "").strip(),
+                    isUnread, senderName, values["SenderEmailAddress"], toDelete, body, atts, values["Size"], index_string(values["ConversationIndex"]))
+                if body is None and not self.lazy:
+                    record = self.fetch_content(record) #Also puts it in cache
+                elif self.cache and body is not None:
+                    self.cache.put(self.storeID, modified, record)
+            yield record
+
+    def read_folder_items(self, folder, filter=None):
+        folderName = folder.Name #folder.FullFolderPath
+        for message in folder.Items.Restrict(filter) if filter else folder.Items: #loop on all messages of folder
+            ID = getattr(message, 'EntryID', None)
+            if ID is None: #Sometimes, recalled messages don't have an ID. We have to exclude them
+                logging.error(f"One recalled message in {folderName} could not be treated")
+                continue
+            modified = message.LastModificationTime
+            record = self.cache.get(self.storeID, ID, modified, folderName) if self.cache else None
+            if record is None: #Not in cache, or modified since it was cached: read it from Outlook
+                start = time.perf_counter()
+                record = self.read_message(message, ID, folderName, not self.lazy)
+                self.stats.record("MailItem properties", start)
+                if self.cache and record.body is not None:
+                    self.cache.put(self.storeID, modified, record)
+            yield record
+
+    def read_message(self, message, ID, folderName, with_content=True):
+        """Reads the properties of one message. Without content, body and atts are None, except for receipts"""
+        date =  message.CreationTime #.date()   #message.Senton.date() does not always work
+        date = datetime.datetime.combine(date.date(), date.time()) #convert to datetime
+        subject = message.Subject
+        topic = message.ConversationTopic.strip()
+        conversationID = message.ConversationID
+        conversationIndex = index_string(getattr(message, 'ConversationIndex', None))
+        isUnread = message.UnRead
+        senderName = getattr(message, 'SenderName', None) #sometimes (messages undelivered or recalled) there is no sender
+        senderMail = getattr(message, 'SenderEmailAddress', None)
+        mess_size = message.Size
+        if senderName is None: #Recalled or undelivered messages have no sender
+            toDelete = isUnread==False #delete only unread messages
+            body, atts = "", []
+        else:
+            toDelete = False
+            body, atts = self.read_content(message, date, subject) if with_content else (None, None)
+        return Message(folderName, conversationID, ID, date, subject, topic, isUnread, senderName, senderMail, toDelete, body, atts, mess_size,
+            conversationIndex)
+
+    def read_content(self, message, date, subject):
+        """Reads the normalized body and the sorted attachment names of one message"""
+        start = time.perf_counter()
+        body = message.Body
+        self.stats.record("MailItem.Body", start)
+        start = time.perf_counter()
+        body = normalize_body(body)
+        self.stats.record("normalize_body", start)
+        start = time.perf_counter()
+        atts = []
+        attachments = message.Attachments
+        for att in attachments:
+            try:
+                attName = [getattr(att, 'FileName', att.DisplayName)]
+                atts += attName
+            except:
+                if att.Type != 6: #Normally, only type 6 should raise an error
+                    logging.error(f"Type Error for: {date} | {subject} | {att.DisplayName} | {att.Type}")
+                #1-Office, 5-Mail, 6-Img (OLE Document), 7-Link Office
+                #https://docs.microsoft.com/en-us/dotnet/api/microsoft.office.interop.outlook.olattachmenttype?view=outlook-pia
+        atts.sort()
+        self.stats.record("MailItem.Attachments", start)
+        return body, atts
+
+    def fetch_content(self, mess):
+        start = time.perf_counter()
+        try:
+            message = self.namespace.GetItemFromID(mess.ID, self.storeID)
+            self.stats.record("Namespace.GetItemFromID", start)
+            if mess.ID in self.resumed_IDs: #Fetched by the interrupted search, unless it stopped before
+                record = self.cache.get(self.storeID, mess.ID, message.LastModificationTime, mess.folderName)
+                if record is not None:
+                    return record
+            body, atts = self.read_content(message, mess.date, mess.subject)
+        except Exception as e: #Moved or deleted since its folder was read: it is left out of the search (see outlook_engine.drop_unread)
+            logging.warning(f"Could not read: {mess.date} | {mess.subject} | {mess.folderName} ({e!r})")
+            return mess
+        mess = mess._replace(body=body, atts=atts)
+        if self.cache:
+            self.cache.put(self.storeID, message.LastModificationTime, mess)
+        return mess
+
+    def close(self, completed):
+        if self.cache:
+            self.stats.counters.update(cache_hits=self.cache.hits, cache_misses=self.cache.misses)
+            if completed:
+                self.cache.purge(self.storeID) #All folders were read: forget messages that no longer exist
+            self.cache.close()
+            self.cache = None
+
+def delete_outlook_messages(targets, get_namespace, storeID, progress, interrupted, retries=2, stats=None):
+    """Moves to Deleted Items the messages targets [(row, EntryID, folderName)], folder by folder and in batches of DELETE_BATCH.
+    get_namespace(reconnect) returns the MAPI namespace, reconnecting to Outlook if reconnect is True and the connection was lost.
+    A message that can't be deleted is retried up to retries times after a reconnection.
+    progress(n) is called after each message, and should be throttled (see outlook_stats.ProgressReporter).
+    Stops after the current batch if interrupted() is True. Returns the sets of rows deleted and failed.
+    stats is an optional outlook_stats.RunStats, that records the latency of deletions"""
+    deleted, failed = set(), set()
+    namespace = get_namespace(False)
+    targets = sorted(targets, key=lambda target: target[2]) #Messages of the same folder are deleted together
+    for folderName, folderTargets in itertools.groupby(targets, key=lambda target: target[2]):
+        folderTargets = list(folderTargets)
+        for start in range(0, len(folderTargets), DELETE_BATCH):
+            if interrupted():
+                logging.info("Deletion interrupted by user")
+                return deleted, failed
+            for row, ID, folderName in folderTargets[start:start+DELETE_BATCH]:
+                for attempt in range(retries + 1):
+                    try:
+                        call_start = time.perf_counter()
+                        namespace.GetItemFromID(ID, storeID).Delete() #Delete in Outlook
+                        if stats is not None:
+                            stats.record("MailItem.Delete", call_start)
+                        deleted.add(row)
+                        break
+                    except Exception as e: #Possibly a lost connection: reconnect and retry
+                        logging.debug(f"Could not delete {ID} in {folderName} (attempt {attempt+1}): {e}")
+                        if attempt < retries:
+                            namespace = get_namespace(True)
+                else:
+                    logging.error(f"Could not delete a message of {folderName}")
+                    failed.add(row)
+                progress(len(deleted) + len(failed))
+    if stats is not None:
+        stats.counters.update(deleted=len(deleted), delete_failed=len(failed))
+    return deleted, failed
+
+class FolderWindow:
+    """Items of an Outlook folder created in [start, end). start and end are rounded to the minute"""
+    def __init__(self, folder, start, end):
+        self.folder, self.start, self.end = folder, start, end
+        self.filter = f"[CreationTime] >= '{start.strftime(RESTRICT_DATE_FORMAT)}' AND [CreationTime] < '{end.strftime(RESTRICT_DATE_FORMAT)}'"
+
+    @property
+    def Name(self):
+        return self.folder.Name
+
+class OfflineSource(MailSource):
+    """Reads an exported archive: a Maildir (with its sub-folders), a mbox file, or a directory tree of .eml and .mbox files.
+    Messages of a thread share the conversationID of its first message (References / In-Reply-To headers)."""
+    SUBJECT_PREFIX = re.compile(r"^((re|fw|fwd|tr|aw|wg)\s*:\s*)+", re.IGNORECASE)
+
+    def __init__(self, path, excluded_folders=(), include_subfolders=True, deleted_folder="Deleted Items"):
+        self.path = os.path.abspath(path)
+        self.storeID = self.path
+        self.deleted_folder = deleted_folder
+        self.excluded_folders = list(excluded_folders)
+        self.include_subfolders = include_subfolders
+
+    def list_folders(self): #Archives are streamed message by message, so big folders are not split
+        if os.path.isfile(self.path):
+            boxes = [(os.path.splitext(os.path.basename(self.path))[0], (self.path, mailbox.mbox(self.path, create=False)), '', 1)]
+        elif all(os.path.isdir(os.path.join(self.path, sub)) for sub in ("cur", "new", "tmp")):
+            boxes = self.get_maildirs(self.path, "Inbox", '', 1)
+        else:
+            boxes = self.get_directories()
+        folders, self.total_count = [], 0
+        for name, box, parent_folder, n in boxes: #box is (path, mailbox)
+            if name in self.excluded_folders:
+                continue
+            email_count = len(box[1])
+            folders.append((name, box, parent_folder, email_count, n))
+            self.total_count += email_count
+        return folders
+
+    def get_maildirs(self, path, name, parent_folder, n):
+        box = mailbox.Maildir(path, create=False)
+        boxes = [(name, (path, box), parent_folder, n)]
+        if self.include_subfolders:
+            for subName in box.list_folders(): #Maildir++ sub-folders are stored in ".subName" directories
+                boxes += self.get_maildirs(os.path.join(path, "." + subName), subName, name, n+1)
+        return boxes
+
+    def get_directories(self):
+        """Each directory containing .eml files is a folder, and so is each .mbox file"""
+        boxes = []
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            dirnames.sort()
+            n = dirpath[len(self.path):].count(os.sep) + 1
+            name = os.path.basename(dirpath)
+            parent_folder = os.path.basename(os.path.dirname(dirpath))
+            emls = [os.path.join(dirpath, f) for f in sorted(filenames) if f.lower().endswith(".eml")]
+            if emls:
+                boxes.append((name, (dirpath, EmlDirectory(emls)), parent_folder, n))
+            for f in sorted(filenames):
+                if f.lower().endswith(".mbox"):
+                    path = os.path.join(dirpath, f)
+                    boxes.append((os.path.splitext(f)[0], (path, mailbox.mbox(path, create=False)), name, n+1))
+            if not self.include_subfolders:
+                break
+        return boxes
+
+    def folder_key(self, folder):
+        return (folder[1][0], folder[3]) #Path of the mailbox or directory, and number of messages
+
+    def read_folder(self, folder):
+        folderName, (path, box) = folder[0], folder[1]
+        for key, msg in box.iteritems():
+            yield self.read_message(msg, f"{path}#{key}", folderName, len(msg.as_bytes()))
+
+    def read_message(self, msg, ID, folderName, mess_size):
+        """Converts an email.message.Message to a Message, like OutlookSource.read_message"""
+        subject = decode_header(msg.get("Subject", ""))
+        topic = self.SUBJECT_PREFIX.sub("", subject).strip()
+        references = (msg.get("References", "") or "").split() + (msg.get("In-Reply-To", "") or "").split()
+        references = list(dict.fromkeys(references)) #In-Reply-To is usually the last reference
+        conversationID = references[0] if references else str(msg.get("Message-ID") or topic).strip()
+        conversationIndex = " ".join(references + [str(msg.get("Message-ID") or ID).strip()]) #Path from the first message of the thread
+        try:
+            date = email.utils.parsedate_to_datetime(msg.get("Date"))
+            if date.tzinfo is not None:
+                date = date.astimezone().replace(tzinfo=None) #Local time, as CreationTime in Outlook
+        except (TypeError, ValueError):
+            date = datetime.datetime(1970, 1, 1)
+        flags = msg.get_flags() if hasattr(msg, "get_flags") else ""
+        isUnread = isinstance(msg, (mailbox.MaildirMessage, mailbox.mboxMessage)) and not ({"S", "R"} & set(flags))
+        senderName, senderMail = email.utils.parseaddr(decode_header(msg.get("From", "")))
+        senderName = senderName or senderMail or None
+        if msg.get_content_type() == "multipart/report": #Delivery or read receipts have no real sender
+            senderName = None
+        atts = []
+        if senderName is None:
+            toDelete = isUnread==False #delete only unread messages
+            body = ""
+        else:
+            toDelete = False
+            plain, html_text = None, None
+            for part in msg.walk():
+                if part.is_multipart():
+                    continue
+                filename = part.get_filename()
+                if filename or part.get_content_disposition() == "attachment":
+                    atts.append(decode_header(filename or ""))
+                elif part.get_content_type() == "text/plain" and plain is None:
+                    plain = decode_payload(part)
+                elif part.get_content_type() == "text/html" and html_text is None:
+                    html_text = decode_payload(part)
+            if plain is None and html_text is not None:
+                plain = html.unescape(re.sub(r"<[^>]*>", "\n", html_text))
+            body = normalize_body(plain or "")
+            atts.sort()
+        return Message(folderName, conversationID, ID, date, subject, topic, isUnread, senderName, senderMail, toDelete, body, atts, mess_size,
+            conversationIndex)
+
+class EmlDirectory:
+    """Minimal mailbox-like access to a list of .eml files"""
+    def __init__(self, paths):
+        self.paths = paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    def iteritems(self):
+        for path in self.paths:
+            with open(path, "rb") as f:
+                yield os.path.basename(path), email.message_from_binary_file(f)
+
+def index_string(value):
+    """ConversationIndex as an hexadecimal string: each reply appends 5 bytes to the index of its parent. Tables may return bytes"""
+    if value is None:
+        return ""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex().upper()
+    return str(value)
+
+def decode_header(value):
+    """Decodes an RFC 2047 header (=?utf-8?q?...?=) to a str"""
+    try:
+        return str(email.header.make_header(email.header.decode_header(str(value))))
+    except (LookupError, ValueError, email.errors.HeaderParseError):
+        return str(value)
+
+def decode_payload(part):
+    payload = part.get_payload(decode=True) or b""
+    try:
+        return payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+    except LookupError: #Unknown charset
+        return payload.decode("latin-1")
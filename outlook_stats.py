@@ -0,0 +1,128 @@
+"""Instrumentation of a search by Outlook - Cleaning.py: stage times, folder throughput, latency of COM calls and comparison counts.
+Cheap enough to stay enabled: a perf_counter() and a few additions per call. The result is a JSON run report."""
+import time, datetime, json, bisect, collections
+
+LATENCY_BUCKETS_MS = [0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000] #Upper bounds of the histogram buckets. Slower calls go in a last bucket
+PROGRESS_INTERVAL = 0.1 #Minimum seconds between two progress updates (10 Hz)
+
+class RunStats:
+    """Statistics of one search. Must be updated from a single thread (the search worker). Worker processes return compare counts"""
+    def __init__(self, **info):
+        self.info = info #Context of the run, e.g. mailbox and workers
+        self.started = datetime.datetime.now()
+        self.start = time.perf_counter()
+        self.stages = {} #stage: seconds
+        self.stage, self.stage_start = None, None
+        self.folders = [] #(folder name, messages, seconds)
+        self.calls = {} #call name: [count, total seconds, [count per bucket]]
+        self.compare = collections.Counter() #Conversations, pairs of messages, candidates after pruning, and text comparisons
+        self.counters = collections.Counter() #Other counts: messages, receipts, contents read...
+
+    def new_stage(self, stage): #Ends the current stage, and starts stage
+        self.end_stage()
+        self.stage, self.stage_start = stage, time.perf_counter()
+
+    def end_stage(self):
+        if self.stage is not None:
+            self.stages[self.stage] = self.stages.get(self.stage, 0) + time.perf_counter() - self.stage_start
+        self.stage = None
+
+    def record(self, call, start):
+        """Records a call started at perf_counter() start, e.g. a COM call"""
+        seconds = time.perf_counter() - start
+        entry = self.calls.get(call)
+        if entry is None:
+            entry = self.calls[call] = [0, 0.0, [0] * (len(LATENCY_BUCKETS_MS) + 1)]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2][bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+
+    def folder(self, name, messages, seconds):
+        self.folders.append((name, messages, seconds))
+
+    def merge(self, other, name):
+        """Adds the statistics of the search other, e.g. of the mailbox name searched in another thread. Stage times are summed"""
+        for stage, seconds in other.stages.items():
+            self.stages[stage] = self.stages.get(stage, 0) + seconds
+        self.folders += [(f"{name}/{folder}", messages, seconds) for folder, messages, seconds in other.folders]
+        for call, (count, total, histogram) in other.calls.items():
+            entry = self.calls.get(call)
+            if entry is None:
+                entry = self.calls[call] = [0, 0.0, [0] * (len(LATENCY_BUCKETS_MS) + 1)]
+            entry[0] += count
+            entry[1] += total
+            entry[2] = [n + n2 for n, n2 in zip(entry[2], histogram)]
+        self.compare.update(other.compare)
+        self.counters.update(other.counters)
+
+    def report(self):
+        """Returns the run report, as a dict that can be saved in JSON"""
+        bucket_names = [f"<{limit}ms" for limit in LATENCY_BUCKETS_MS] + [f">={LATENCY_BUCKETS_MS[-1]}ms"]
+        return {"started": self.started.isoformat(timespec="seconds"), **self.info,
+            "total_seconds": round(time.perf_counter() - self.start, 3),
+            "stages": {stage: round(seconds, 3) for stage, seconds in self.stages.items()},
+            "folders": [{"name": name, "messages": messages, "seconds": round(seconds, 3),
+                "messages_per_s": round(messages / seconds) if seconds else None} for name, messages, seconds in self.folders],
+            "calls": {call: {"count": count, "total_seconds": round(total, 3), "mean_ms": round(total / count * 1000, 3),
+                "histogram": {name: n for name, n in zip(bucket_names, histogram) if n}} for call, (count, total, histogram) in self.calls.items()},
+            "compare": dict(self.compare), "counters": dict(self.counters)}
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+
+    def summary(self):
+        """Short text of the report, for the Stats panel"""
+        report = self.report()
+        lines = [f"Search started {report['started']}, {report['total_seconds']:.1f} s"]
+        lines += [f"    {stage}: {seconds:.1f} s" for stage, seconds in report["stages"].items()]
+        lines.append("Counts: " + ", ".join(f"{name} {count}" for name, count in report["counters"].items()))
+        if report["compare"]:
+            lines.append("Comparison: " + ", ".join(f"{name} {count}" for name, count in report["compare"].items()))
+        lines.append("Calls (count, total, mean):")
+        lines += [f"    {call}: {values['count']}, {values['total_seconds']:.1f} s, {values['mean_ms']:.2f} ms"
+            for call, values in sorted(report["calls"].items(), key=lambda item: -item[1]["total_seconds"])]
+        lines.append("Slowest folders (messages/s):")
+        lines += [f"    {folder['name']}: {folder['messages']} messages in {folder['seconds']:.1f} s ({folder['messages_per_s']})"
+            for folder in sorted(report["folders"], key=lambda folder: -folder["seconds"])[:10]]
+        return "\n".join(lines)
+
+class ProgressReporter:
+    """Coalesces the progress of a worker to one update every interval seconds, and adds the throughput and ETA of the step to its text.
+    newStep(text, minimum, maximum), progress(n) and status(text) are the callbacks to throttle, e.g. emit methods of Qt signals"""
+    def __init__(self, newStep, progress, status, interval=PROGRESS_INTERVAL):
+        self.newStep_callback, self.progress_callback, self.status_callback = newStep, progress, status
+        self.interval = interval
+        self.text, self.minimum, self.maximum, self.rate = "", 0, 100, True
+        self.n = 0
+        self.step_start = self.last = time.monotonic()
+
+    def new_step(self, text, minimum=0, maximum=100, rate=True):
+        """rate=False if progress is not a number of items (e.g. per mille of several searches): only the ETA is shown, not the items per second"""
+        self.text, self.minimum, self.maximum, self.rate = text, minimum, maximum, rate
+        self.n = minimum
+        self.step_start = self.last = time.monotonic()
+        self.newStep_callback(text, minimum, maximum)
+
+    def set_text(self, text): #Changes the text of the step, without resetting its progress, its throughput and its ETA
+        self.text = text
+        self.status_callback(self.status(self.n, time.monotonic()))
+
+    def progress(self, n): #Called for each message: must stay cheap
+        self.n = n
+        now = time.monotonic()
+        if now - self.last >= self.interval or n >= self.maximum:
+            self.last = now
+            self.progress_callback(n)
+            self.status_callback(self.status(n, now))
+
+    def status(self, n, now):
+        """Text of the step, with the number of items per second, and the estimated remaining time"""
+        done, seconds = n - self.minimum, now - self.step_start
+        if done <= 0 or seconds <= 0:
+            return self.text
+        rate = done / seconds
+        text = f"{self.text} - {rate:,.0f}/s" if self.rate else self.text
+        if n < self.maximum:
+            text += f"{',' if self.rate else ' -'} about {datetime.timedelta(seconds=round((self.maximum - n) / rate))} left"
+        return text
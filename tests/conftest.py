@@ -0,0 +1,2 @@
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) #The modules of Outlook - Cleaning.py are at the root of the repository
@@ -0,0 +1,62 @@
+"""The scan cache reuses the messages not modified since the last search, and forgets the ones that no longer exist"""
+import sqlite3, datetime
+import outlook_engine, outlook_sources, outlook_cache, outlook_stats
+from outlook_benchmark import generate_mailbox, ignore
+
+def search(namespace, path, max_entries=200000, rebuild=False):
+    """Returns the rows and the stats of a search of namespace with the cache in path"""
+    source = outlook_sources.OutlookSource(namespace, namespace.top_folder.Name, [], True, 20000)
+    source.cache = outlook_cache.ScanCache(path, max_entries, rebuild)
+    stats = outlook_stats.RunStats()
+    rows = outlook_engine.search_duplicates(source, ignore, ignore, lambda: False, stats=stats)
+    return rows, stats.counters
+
+def cached(path): #EntryIDs in the cache
+    connection = sqlite3.connect(path)
+    IDs = {row[0] for row in connection.execute("SELECT entryID FROM messages")}
+    connection.close()
+    return IDs
+
+def test_hits_and_modified(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    namespace = generate_mailbox(2000, seed=5)
+    rows, counters = search(namespace, path)
+    IDs = cached(path)
+    assert IDs and counters["cache_hits"] == 0
+    rows2, counters2 = search(namespace, path)
+    assert rows2 == rows
+    assert counters2["cache_hits"] == len(IDs) and counters2["contents_read"] == 0 #No body read again from Outlook
+    modified = namespace.items[min(IDs)]
+    modified.LastModificationTime += datetime.timedelta(minutes=1)
+    rows2, counters2 = search(namespace, path)
+    assert rows2 == rows
+    assert counters2["cache_hits"] == len(IDs) - 1
+
+def test_purge(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    namespace = generate_mailbox(2000, seed=5)
+    search(namespace, path)
+    deleted = namespace.items[min(cached(path))]
+    del deleted.Parent.Items.items[deleted.EntryID]
+    del namespace.items[deleted.EntryID]
+    search(namespace, path)
+    assert deleted.EntryID not in cached(path)
+    assert cached(path) <= set(namespace.items)
+
+def test_eviction(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    namespace = generate_mailbox(2000, seed=5)
+    search(namespace, path)
+    assert len(cached(path)) > 50
+    rows, counters = search(namespace, path, max_entries=50)
+    assert len(cached(path)) == 50
+    assert search(namespace, path, max_entries=50)[0] == rows
+
+def test_rebuild(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    namespace = generate_mailbox(2000, seed=5)
+    search(namespace, path)
+    outlook_cache.ScanCache(path, rebuild=True).close()
+    assert not cached(path)
+    rows, counters = search(namespace, path, rebuild=True)
+    assert counters["cache_hits"] == 0 and cached(path)
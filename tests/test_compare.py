@@ -0,0 +1,67 @@
+"""compare_conversation against the historical loop of search_duplicates_b (iterrows on each conversation, then `in` on the bodies),
+on randomized conversations. Receipts (toDelete) are not generated: group_conversations sets them apart before comparison"""
+import random, datetime
+import pytest
+import outlook_engine
+from outlook_engine import Message
+
+DELETED = "Deleted Items"
+
+def historical_loop(subList, deleted_folder):
+    """The pandas loop of the first version, on a list of Messages: [(ID, newerID)] of the messages contained in a newer one"""
+    found = []
+    for mess in subList: #Loop on all messages in a conversation
+        subList2 = [mess2 for mess2 in subList if mess2.date > mess.date and mess2.toDelete == False] #List messages that are more recent
+        if mess.folderName != deleted_folder: #If the messsage is not Deleted, we don't want to compare it with Deleted messages
+            subList2 = [mess2 for mess2 in subList2 if mess2.folderName != deleted_folder]
+        for mess2 in subList2: #Search messages in the same Conversation that contain mess
+            if all(att in mess2.atts for att in mess.atts) and mess.body in mess2.body:
+                found.append((mess.ID, mess2.ID))
+                break #stop looping on subList2
+    return found
+
+def random_conversation(rnd, with_index):
+    """Messages with few distinct bodies, dates and attachments, so that containment, ties of dates and Deleted Items are frequent"""
+    messages, indexes = [], []
+    for i in range(rnd.randint(0, 12)):
+        body = "".join(rnd.choice("ab") for _ in range(rnd.randint(0, 6)))
+        atts = sorted(rnd.sample(["a.pdf", "b.xlsx", "c.png"], rnd.randint(0, 2)))
+        date = datetime.datetime(2023, 1, 1) + datetime.timedelta(hours=rnd.randint(0, 6))
+        index = None
+        if with_index:
+            index = rnd.choice(indexes) + f"{i:02x}" if indexes and rnd.random() < 0.8 else "00"
+            indexes.append(index)
+        messages.append(Message(rnd.choice(["Inbox", "Sent Items", DELETED]), "conv", f"id{i}", date, "subject", "topic", False, "sender",
+            "sender@example.com", False, body, atts, 100, index))
+    return messages
+
+def contains(mess, mess2): #mess2 is a valid container of mess for the historical loop
+    return (mess2.date > mess.date and (mess.folderName == DELETED or mess2.folderName != DELETED)
+        and all(att in mess2.atts for att in mess.atts) and mess.body in mess2.body)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_same_rows_as_historical_loop(seed):
+    rnd = random.Random(seed)
+    for _ in range(500):
+        messages = random_conversation(rnd, with_index=False)
+        rows = outlook_engine.compare_conversation(messages, DELETED)
+        assert [(row[2], row[9]) for row in rows] == historical_loop(messages, DELETED)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_reply_tree_finds_the_same_messages(seed):
+    """With conversationIndex, replies are compared first: the same messages are reported, but the newer message may be another valid one"""
+    rnd = random.Random(seed)
+    for _ in range(500):
+        messages = random_conversation(rnd, with_index=True)
+        byID = {mess.ID: mess for mess in messages}
+        rows = outlook_engine.compare_conversation(messages, DELETED)
+        assert [row[2] for row in rows] == [ID for ID, newerID in historical_loop(messages, DELETED)]
+        assert all(contains(byID[row[2]], byID[row[9]]) for row in rows)
+
+def test_without_reply_tree(monkeypatch):
+    monkeypatch.setattr(outlook_engine, "USE_REPLY_TREE", False)
+    rnd = random.Random(42)
+    for _ in range(500):
+        messages = random_conversation(rnd, with_index=True)
+        rows = outlook_engine.compare_conversation(messages, DELETED)
+        assert [(row[2], row[9]) for row in rows] == historical_loop(messages, DELETED)
@@ -0,0 +1,26 @@
+"""Messages moved or deleted between the read of the folders and the fetch of their bodies are left out of the search"""
+import random
+import outlook_engine, outlook_sources, outlook_stats
+from outlook_benchmark import generate_mailbox, ignore
+
+def delete_permanently(namespace, item):
+    del item.Parent.Items.items[item.EntryID]
+    del namespace.items[item.EntryID]
+
+def source(namespace):
+    return outlook_sources.OutlookSource(namespace, namespace.top_folder.Name, [], True, 20000)
+
+def test_deleted_between_read_and_fetch():
+    namespace = generate_mailbox(2000, seed=3)
+    rnd = random.Random(0)
+    victims = rnd.sample([item for item in namespace.items.values() if item.MessageClass == "IPM.Note"], 30)
+    def newStep(text, minimum=0, maximum=100):
+        if text.startswith("Step 2/3") and victims[0].EntryID in namespace.items: #Once the folders were read
+            for item in victims:
+                delete_permanently(namespace, item)
+    stats = outlook_stats.RunStats()
+    rows = outlook_engine.search_duplicates(source(namespace), newStep, ignore, lambda: False, stats=stats)
+    assert stats.counters["unreadable"] > 0
+    deleted = {item.EntryID for item in victims}
+    assert not any(row[2] in deleted or row[9] in deleted for row in rows)
+    assert sorted(rows) == sorted(outlook_engine.search_duplicates(source(namespace), ignore, ignore, lambda: False))
@@ -0,0 +1,70 @@
+"""BodyNormalizer against the normalization of the first version (remove_mailtos, remove_urls, then find_replace_text for each banner),
+kept as outlook_benchmark.legacy_normalize. Golden cases give the same body with both. Documented differences are the expected ones"""
+import random
+import pytest
+from outlook_engine import BodyNormalizer, body_rules, BODY_BANNERS
+from outlook_benchmark import legacy_normalize
+
+NORMALIZER = BodyNormalizer(body_rules())
+
+GOLDEN = [
+    ("Hello,\r\n  how are you?\r\nRegards", "Hello,how are you?Regards"),
+    ("", ""),
+    ("Regards John <mailto:john.doe@example.com> \r\nSent", "Regards JohnSent"),
+    ("John <mailto:john.doe@example.com> and John <mailto:john.doe@example.com>", "Johnand John"),
+    ("Jane <mailto:jane@example.com>", "Jane"),
+    ("mailto without space<mailto:jane@example.com>", "mailto without space<mailto:jane@example.com>"),
+    ("See https://example.com/doc <https://example.com/doc> for details", "See https://example.com/docfor details"),
+    ("See http://example.com <http://example.com>", "See http://example.com"),
+    ("See https://example.com/doc <https://example.com/other> too", "See https://example.com/doc <https://example.com/other> too"),
+    ("Link <https://example.com> alone", "Link <https://example.com> alone"),
+    ("https://a.com <https://a.com> <https://a.com>", "https://a.com<https://a.com>"),
+    ("C1 - Internal use\r\nHello", "Hello"),
+    ("Hello C2 - Confidential world C3 - Highly Confidential", "Hello  world "),
+    ("C1 - Internal use https://a.com <https://a.com> John <mailto:j@a.com> C1 - Internal use", " https://a.comJohn"),
+]
+
+@pytest.mark.parametrize("body, expected", GOLDEN)
+def test_golden(body, expected):
+    assert legacy_normalize(body) == expected
+    assert NORMALIZER(body) == expected
+
+#Differences with the first version: (body, first version, BodyNormalizer, banners)
+DIFFERENCES = [
+    #find_replace_text searched again after each removal: a banner formed by removing another one was removed too. Banners are removed in one pass
+    ("C1 - InteC1 - Internal usernal use", "", "C1 - Internal use", BODY_BANNERS),
+    #Banners were removed one after the other, in their order. They are now removed in one pass, the leftmost first: a banner that contains
+    #an earlier one is removed whole
+    ("Highly Confidential", "Highly ", "", ["Confidential", "Highly Confidential"]),
+    #A link found with and without its trailing space: remove_mailtos replaced the first form found everywhere, leaving the space after the
+    #others. Each link is now removed with its own space
+    ("a <mailto:x@y.cd><b <mailto:x@y.cd> c", "a<b c", "a<bc", BODY_BANNERS),
+    #A URL repeated twice after its text: remove_urls removed both, the first removal making the second one follow the text. One is removed
+    ("See http://a.com <http://a.com>  <http://a.com>", "See http://a.com", "See http://a.com <http://a.com>", BODY_BANNERS),
+]
+
+@pytest.mark.parametrize("body, legacy, normalized, banners", DIFFERENCES)
+def test_documented_differences(body, legacy, normalized, banners):
+    assert legacy_normalize(body, banners) == legacy
+    assert BodyNormalizer(body_rules(banners))(body) == normalized
+
+def test_without_banners():
+    body = "C1 - Internal use John <mailto:j@a.com>"
+    assert BodyNormalizer(body_rules([]))(body) == legacy_normalize(body, []) == "C1 - Internal use John"
+
+def test_rules_without_triggers():
+    """Rules of the table format without triggers run on every body"""
+    normalizer = BodyNormalizer([(name, pattern, replacement) for name, pattern, replacement, triggers in body_rules()])
+    for body, expected in GOLDEN:
+        assert normalizer(body) == expected
+
+@pytest.mark.parametrize("seed", range(3))
+def test_random_bodies(seed):
+    """Same body on random sequences of the texts each rule looks for, separated by words as in messages, unlike the documented differences"""
+    texts = ["John <mailto:john.doe@example.com>", "John <mailto:john.doe@example.com> ", "Jane <mailto:j.smith@example.co.uk>",
+        "https://example.com/doc <https://example.com/doc>", "http://example.com <http://example.com> ", "https://example.com <https://example.org>",
+        "<https://example.com>", "mailto:john.doe@example.com>", "C1 - Internal use", "C2 - Confidential", "C3 - Highly Confidential", "<", ">", ""]
+    rnd = random.Random(seed)
+    for _ in range(20000):
+        body = "".join(rnd.choice(texts) + rnd.choice([" word ", " ", " word\r\n  word "]) for _ in range(rnd.randint(1, 8)))
+        assert NORMALIZER(body) == legacy_normalize(body)
@@ -0,0 +1,27 @@
+"""The reader process gives the rows of the search in process, even when its child exits in the middle of a folder"""
+import os, functools
+import outlook_engine, outlook_process, outlook_stats
+from outlook_benchmark import benchmark_source, ignore
+
+def crashing_source(nb_messages, seed, crash_file):
+    """benchmark_source whose child exits in the middle of a folder, once: crash_file tells the restarted child not to"""
+    source = benchmark_source(nb_messages, seed)
+    if not os.path.exists(crash_file):
+        read = source.read_folder
+        def read_folder(folder):
+            for i, mess in enumerate(read(folder)):
+                if i == 450:
+                    open(crash_file, "w").close()
+                    os._exit(3)
+                yield mess
+        source.read_folder = read_folder
+    return source
+
+def test_reader_restarted(tmp_path):
+    crash_file = str(tmp_path / "crashed")
+    rows = outlook_engine.search_duplicates(benchmark_source(3000, 1), ignore, ignore, lambda: False)
+    stats = outlook_stats.RunStats()
+    source = outlook_process.ProcessSource(functools.partial(crashing_source, 3000, 1, crash_file))
+    assert outlook_engine.search_duplicates(source, ignore, ignore, lambda: False, stats=stats) == rows
+    assert os.path.exists(crash_file)
+    assert stats.counters["reader_restarts"] == 1
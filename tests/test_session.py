@@ -0,0 +1,23 @@
+"""Saved sessions give back the rows of the search, None values included"""
+import datetime
+import pytest
+import outlook_session
+
+ROWS = [("john.doe@company.com", "Inbox", "C1", "ID1", datetime.datetime(2023, 7, 4, 10, 30), "Hello", "Hello", "jane@company.com", True, 1234,
+        "ID2", "Sent Items", datetime.datetime(2023, 7, 4, 11, 0, 0, 123), "contained", None),
+    ("john.doe@company.com", "Inbox", None, "ID3", datetime.datetime(2023, 7, 5), "Undeliverable: Hello", "Hello", None, True, 567,
+        None, None, None, "receipt", None),
+    ("john.doe@company.com", "Projects", "C2", "ID4", datetime.datetime(2023, 7, 6), "", "", "jane@company.com", False, 89,
+        "ID5", "Projects", datetime.datetime(2023, 7, 7), "to review", 0.75)]
+
+@pytest.mark.parametrize("extension", [".csv", ".parquet", ".arrow"])
+def test_round_trip(tmp_path, extension):
+    if extension != ".csv":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / ("session" + extension))
+    writer = outlook_session.SessionWriter(path, {"StoreIDs": {"john.doe@company.com": "ABC"}, "total_count": 10})
+    for row in ROWS:
+        writer.write_row(row)
+    writer.close()
+    assert outlook_session.read_metadata(path)["StoreIDs"] == {"john.doe@company.com": "ABC"}
+    assert [row for rows in outlook_session.iter_session(path) for row in rows] == ROWS
@@ -0,0 +1,40 @@
+"""find_similar on a short message and a long reply that quotes part of it: the decision is taken on the exact containment of shingles"""
+import random, datetime
+import pytest
+np = pytest.importorskip("numpy")
+import outlook_engine, outlook_similarity
+from outlook_engine import Message
+from outlook_benchmark import ignore
+
+WORDS = [f"word{i}" for i in range(5000)]
+
+def search(rnd, overlap, same_conversation=True, short=30, long=500):
+    """Rows of find_similar for a message of short words, and a newer one of long words followed by overlap of the first message"""
+    text = rnd.choices(WORDS, k=short)
+    quoted = text[:int(short * overlap)] + rnd.choices(WORDS, k=short - int(short * overlap))
+    reply = rnd.choices(WORDS, k=long) + quoted
+    store = outlook_engine.MessageStore()
+    date = datetime.datetime(2023, 1, 1)
+    for i, words in enumerate((text, reply)):
+        store.append(Message("Inbox", "conv" if same_conversation else f"conv{i}", f"id{i}", date + datetime.timedelta(hours=i), "subject",
+            "topic", False, "sender", "sender@example.com", False, " ".join(words), [], 100, None))
+    return outlook_similarity.find_similar(store, set(), "Deleted Items", 0.9, ignore, ignore, lambda: False)
+
+@pytest.mark.parametrize("overlap", [0.3, 0.5, 0.7])
+def test_partial_quote_is_never_similar(overlap):
+    rnd = random.Random(0)
+    for _ in range(50):
+        assert all(row[-2] != "similar" for row in search(rnd, overlap))
+
+def test_short_message_quoted_in_long_reply():
+    rnd = random.Random(1)
+    for _ in range(50):
+        rows = search(rnd, 1.0)
+        assert [(row[2], row[9], row[-2], row[-1]) for row in rows] == [("id0", "id1", "similar", 1.0)]
+
+def test_to_review_below_threshold():
+    rows = search(random.Random(2), 0.8)
+    assert [row[-2] for row in rows] == ["to review"] and 0.6 <= rows[0][-1] < 0.9
+
+def test_containment():
+    assert outlook_similarity.containment(np.array([1, 2, 3, 4], dtype=np.uint64), np.array([2, 3, 4, 5, 6], dtype=np.uint64)) == 0.75
@@ -0,0 +1,22 @@
+"""Folders read by Table give the messages read item by item, even when the Table rejects some columns"""
+import pytest
+import outlook_sources
+from outlook_benchmark import generate_mailbox, FakeColumns
+
+REJECTED = ("SenderEmailAddress", "ConversationIndex")
+
+def add(self, name): #Columns.Add of a store that doesn't provide some properties in its tables
+    if name in REJECTED:
+        raise ValueError(f"Unknown property {name}")
+    self.names.append(name)
+
+@pytest.mark.parametrize("lazy", [True, False])
+def test_rejected_columns(monkeypatch, lazy):
+    namespace = generate_mailbox(2000, seed=6)
+    source = outlook_sources.OutlookSource(namespace, namespace.top_folder.Name, [], True, 20000)
+    source.lazy = lazy
+    monkeypatch.setattr(FakeColumns, "Add", add)
+    for folder in source.list_folders():
+        by_table = list(source.read_folder(folder))
+        assert by_table == list(source.read_folder_items(folder[1]))
+    assert source.stats.calls["Table missing columns"]
@@ -0,0 +1,31 @@
+"""Big folders are read by windows of CreationTime, or without windows if the windows don't cover all their items"""
+import outlook_engine, outlook_sources
+from outlook_benchmark import generate_mailbox, ignore, FakeItems
+
+restrict = FakeItems.Restrict
+
+def source(namespace, folder_size_limit):
+    return outlook_sources.OutlookSource(namespace, namespace.top_folder.Name, [], True, folder_size_limit)
+
+def restrict_day_first(self, filter):
+    """Restrict of an Outlook that reads the dates of the filters as day/month: the items of the 13th to the 31st are missed"""
+    return FakeItems({ID: item for ID, item in restrict(self, filter).items.items() if item.CreationTime.day <= 12})
+
+def windows(folders):
+    return [folder for folder in folders if isinstance(folder[1], outlook_sources.FolderWindow)]
+
+def test_windows():
+    namespace = generate_mailbox(3000, seed=4)
+    folders = source(namespace, 500).list_folders()
+    assert windows(folders)
+    assert sum(folder[3] for folder in folders) == sum(folder[3] for folder in source(namespace, 20000).list_folders())
+    rows = outlook_engine.search_duplicates(source(namespace, 500), ignore, ignore, lambda: False)
+    assert sorted(rows) == sorted(outlook_engine.search_duplicates(source(namespace, 20000), ignore, ignore, lambda: False))
+
+def test_windows_missing_items(monkeypatch, caplog):
+    namespace = generate_mailbox(3000, seed=4)
+    rows = outlook_engine.search_duplicates(source(namespace, 20000), ignore, ignore, lambda: False)
+    monkeypatch.setattr(FakeItems, "Restrict", restrict_day_first)
+    assert not windows(source(namespace, 500).list_folders())
+    assert "without windows" in caplog.text
+    assert sorted(outlook_engine.search_duplicates(source(namespace, 500), ignore, ignore, lambda: False)) == sorted(rows)